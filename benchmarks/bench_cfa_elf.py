@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+#
+# bench_cfa_elf.py - Compare in-process ELF checks with the tool based ones
+#
+# Copyright (c) 2015 - 2016, Intel Corporation
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Intel Corporation nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Runs the CFA checks on every ELF file below the given directories, once
+with the in-process reader and once with checksec.sh, execstack, readelf and
+objdump, then prints the time taken by each and any verdict that differs.
+
+    python3 benchmarks/bench_cfa_elf.py [--native-only] [dir ...]
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from isafw import isaelf
+from isafw.isaplugins import ISA_cfa_plugin as cfa
+
+
+def elf_files(dirs):
+    for d in dirs:
+        for (dirpath, dirnames, filenames) in os.walk(d):
+            for f in filenames:
+                path = os.path.join(dirpath, f)
+                if os.path.isfile(path) and not os.path.islink(path) and isaelf.read_elf(path):
+                    yield path
+
+
+def timed(fn, files):
+    start = time.time()
+    results = [fn(f) for f in files]
+    return time.time() - start, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--native-only', action='store_true',
+                        help="skip the tool based path")
+    parser.add_argument('dirs', nargs='*', default=['/usr/bin'])
+    args = parser.parse_args()
+
+    files = list(elf_files(args.dirs))
+    print("ELF files: %d" % len(files))
+    native_time, native = timed(cfa.check_file, files)
+    print("in-process: %.2fs (%.0f files/s)" % (native_time, len(files) / max(native_time, 1e-9)))
+    if args.native_only:
+        return 0
+    missing = cfa._check_tools()
+    for tool in ("checksec.sh", "execstack", "readelf"):
+        if not any(os.access(os.path.join(p, tool), os.X_OK)
+                   for p in os.environ["PATH"].split(os.pathsep)):
+            missing += tool + " not found\n"
+    if missing:
+        print(missing + "Cannot run the tool based path.")
+        return 1
+    tools_time, tools = timed(cfa.check_file_tools, files)
+    print("tools:      %.2fs (%.0f files/s)" % (tools_time, len(files) / max(tools_time, 1e-9)))
+    print("speedup:    %.1fx" % (tools_time / max(native_time, 1e-9)))
+    mismatches = 0
+    for f, a, b in zip(files, native, tools):
+        if a != b:
+            mismatches += 1
+            print("MISMATCH %s\n  in-process: %s\n  tools:      %s" % (f, a, b))
+    print("mismatches: %d" % mismatches)
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
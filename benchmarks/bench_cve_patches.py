@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+#
+# bench_cve_patches.py - Benchmark of the CVE ids taken from patch names
+#
+# Copyright (c) 2015 - 2016, Intel Corporation
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Intel Corporation nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Takes the CVE ids out of the patch names of many recipes, once with the
+former partition and split parser and once with ISA_cve_plugin.patch_cves.
+Prints the time taken by each. tests/test_cve_patches.py checks the ids
+patch_cves finds.
+
+Without arguments the recipes are generated. A file with one patch name
+per line, for example from ls of a layer's recipes-*/*/files, is used as
+the patch list of every recipe instead.
+
+    python3 benchmarks/bench_cve_patches.py [-n recipes] [-r repeat] [patches]
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from isafw.isaplugins import ISA_cve_plugin as cve
+
+fillers = ("0001-Makefile-fix-cross-compilation.patch", "fix-host-contamination.patch",
+           "disable-tests.patch", "0002-use-pkg-config.patch", "musl-fixes.patch")
+
+
+def legacy_patch_list(patch_files):
+    patch_info = ""
+    for patch in patch_files:
+        patch1 = patch.partition("cve")
+        if (patch1[0] == patch):
+            # no cve substring, try CVE
+            patch1 = patch.partition("CVE")
+            if (patch1[0] == patch):
+                continue
+        patchstripped = patch1[2].split('-')
+        try:
+            patch_info += " CVE-" + \
+                patchstripped[1] + "-" + re.findall(r'\d+', patchstripped[2])[0]
+        except IndexError:
+            # string parsing attempt failed, so just skip this patch
+            continue
+    return patch_info
+
+
+def current_patch_list(patch_files):
+    patch_info = ""
+    for cve_id in cve.patch_cves(patch_files):
+        patch_info += " " + cve_id
+    return patch_info
+
+
+def synthetic_recipes(count, seed=1):
+    # every recipe comes in four variants (target, native, nativesdk,
+    # multilib) with the same patches, a third of the patches fix CVEs
+    rng = random.Random(seed)
+    recipes = []
+    for i in range(count // 4 + 1):
+        patches = []
+        for j in range(rng.randint(1, 12)):
+            if rng.random() < 0.33:
+                patches.append("%04d-CVE-%d-%d.patch" % (j + 1, rng.randint(2010, 2017),
+                                                         rng.randint(1000, 20000)))
+            else:
+                patches.append(rng.choice(fillers))
+        recipes.extend([patches] * 4)
+    return recipes[:count]
+
+
+def timed(fn, recipes, repeat):
+    elapsed = 0
+    for i in range(repeat):
+        cve.patch_cve_ids.clear()
+        start = time.time()
+        for patches in recipes:
+            fn(patches)
+        elapsed += time.time() - start
+    return elapsed / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--recipes', type=int, default=4000)
+    parser.add_argument('-r', '--repeat', type=int, default=10)
+    parser.add_argument('patches', nargs='?')
+    args = parser.parse_args()
+
+    if args.patches:
+        with open(args.patches) as f:
+            patches = [line.strip() for line in f if line.strip()]
+        recipes = [patches] * args.recipes
+    else:
+        recipes = synthetic_recipes(args.recipes)
+    print("recipes: %d, patch names: %d" % (len(recipes), sum(len(r) for r in recipes)))
+    legacy_time = timed(legacy_patch_list, recipes, args.repeat)
+    current_time = timed(current_patch_list, recipes, args.repeat)
+    print("partition parser: %.2fms" % (legacy_time * 1000))
+    print("patch_cves:       %.2fms" % (current_time * 1000))
+    print("speedup:          %.1fx" % (legacy_time / max(current_time, 1e-9)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+#
+# bench_isafw.py - End-to-end benchmark of the ISA FW plugins
+#
+# Copyright (c) 2015 - 2016, Intel Corporation
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Intel Corporation nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Runs isafw end to end on synthetic inputs and records, for every plugin,
+the throughput, the latency of its callbacks and its peak memory.
+
+The inputs (see synthetic.py) are generated from a seed: a rootfs with
+small ELF binaries for FSA and CFA, a stream of recipes for LA and CVE,
+an NVD feed that CVE matches the recipes against offline, and kernel
+configs for KCA. Every plugin runs alone in a fresh
+interpreter, as in a bitbake task, with a stub bb module that counts the
+errors logged. Timings come from the timings report written by ISA.
+
+The results are printed and can be saved as JSON with -o. Given a former
+result with --compare, the throughput of every plugin is compared and
+the exit status is 1 if one of them dropped by more than --threshold.
+
+    python3 benchmarks/bench_isafw.py [-o results.json] [--compare base.json]
+        [--files N] [--packages N] [--cves N] [--kernels N] [--jobs N] [--seed N]
+        [--plugins name,...] [--workdir dir]
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import types
+
+benchdir = os.path.dirname(os.path.abspath(__file__))
+
+# plugin name: (callback measured for the throughput, unit of its input)
+plugins = collections.OrderedDict([
+    ("ISA_FSChecker", ("process_filesystem", "objects")),
+    ("ISA_CFChecker", ("process_filesystem", "elf")),
+    ("ISA_LicenseChecker", ("process_package", "packages")),
+    ("ISA_CVEChecker", ("process_package", "packages")),
+    ("ISA_KernelChecker", ("process_kernel", "kernels")),
+])
+
+
+def install_bb_stub():
+    # isafw logs through bb.error when bb can be imported, as in a task
+    bb = types.ModuleType('bb')
+    bb.messages = collections.Counter()
+
+    def logger(level):
+        def log(*args):
+            bb.messages[level] += 1
+            if level == 'error':
+                sys.stderr.write(" ".join(str(a) for a in args) + "\n")
+        return log
+    for level in ('plain', 'note', 'warn', 'error', 'debug'):
+        setattr(bb, level, logger(level))
+    sys.modules['bb'] = bb
+    return bb
+
+
+def generate(workdir, args):
+    # runs in its own interpreter too, the peak RSS of the main one shows
+    # up in the plugin runs it starts
+    import synthetic
+    inputs = synthetic.make_rootfs(os.path.join(workdir, "rootfs"), args.files, seed=args.seed)
+    os.mkdir(os.path.join(workdir, "kernels"))
+    synthetic.write_kernel_configs(os.path.join(workdir, "kernels"), args.kernels, seed=args.seed)
+    os.mkdir(os.path.join(workdir, "nvd"))
+    synthetic.write_nvd_feed(os.path.join(workdir, "nvd", "nvdcve-1.1-synthetic.json.gz"),
+                             args.cves, args.packages, seed=args.seed)
+    inputs["packages"] = args.packages
+    inputs["cves"] = args.cves
+    inputs["kernels"] = args.kernels
+    return inputs
+
+
+def plugin_calls(timings_report, plugin):
+    # (wall, cpu, growth of the peak RSS) of every call, by callback
+    calls = collections.defaultdict(list)
+    with open(timings_report) as f:
+        for line in f:
+            record = json.loads(line)
+            if record["plugin"] == plugin and "tool" not in record:
+                calls[record["callback"]].append((record["wall"], record["cpu"],
+                                                  record["maxrss_growth"]))
+    return calls
+
+
+def run_plugin(plugin, workdir, args):
+    # runs in its own interpreter, see main()
+    bb = install_bb_stub()
+    sys.path.insert(0, os.path.join(benchdir, '..', 'lib'))
+    import synthetic
+    from isafw import isafw
+
+    outdir = os.path.join(workdir, "out", plugin)
+    config = isafw.ISA_config()
+    config.reportdir = os.path.join(outdir, "report")
+    config.logdir = os.path.join(outdir, "log")
+    os.makedirs(config.reportdir)
+    os.makedirs(config.logdir)
+    config.machine = "synthetic"
+    config.timestamp = "bench"
+    config.arch = "x86"
+    config.jobs = args.jobs
+    config.timings = True
+    config.plugin_whitelist = [plugin]
+    config.cve_feeds = [os.path.join(workdir, "nvd")]
+    isa = isafw.ISA(config)
+
+    if plugin in ("ISA_FSChecker", "ISA_CFChecker"):
+        fs = isafw.ISA_filesystem()
+        fs.img_name = "synthetic-image"
+        fs.path_to_fs = os.path.join(workdir, "rootfs")
+        isa.process_filesystem(fs)
+    elif plugin == "ISA_KernelChecker":
+        kernels = os.path.join(workdir, "kernels")
+        for name in sorted(os.listdir(kernels)):
+            kernel = isafw.ISA_kernel()
+            kernel.img_name = name
+            kernel.path_to_config = os.path.join(kernels, name)
+            isa.process_kernel(kernel)
+    else:
+        synthetic.write_pkglist(os.path.join(config.reportdir, "pkglist"), args.packages)
+        for pkg in synthetic.packages(args.packages, seed=args.seed):
+            isa.process_package(pkg)
+        isa.process_report()
+
+    callbacks = {}
+    for callback, calls in plugin_calls(config.timings_report, plugin).items():
+        walls = sorted(call[0] for call in calls)
+        callbacks[callback] = {
+            "calls": len(calls),
+            "wall": sum(walls),
+            "cpu": sum(call[1] for call in calls),
+            "maxrss_growth": sum(call[2] for call in calls),
+            "p50": walls[len(walls) // 2],
+            "max": walls[-1],
+        }
+    return {
+        "callbacks": callbacks,
+        # the plugin has the process to itself, see main()
+        "process_maxrss": isafw.peak_rss(),
+        "errors": bb.messages["error"],
+    }
+
+
+def git_revision():
+    try:
+        with open(os.devnull, 'wb') as DEVNULL:
+            revision = subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                               cwd=benchdir, stderr=DEVNULL)
+        return revision.decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def compare(results, baseline, threshold):
+    regressions = 0
+    print("\n%-20s %12s %12s %8s" % ("plugin", "baseline", "current", "ratio"))
+    for plugin, result in results["plugins"].items():
+        old = baseline.get("plugins", {}).get(plugin)
+        if not old or not old.get("throughput") or not result.get("throughput"):
+            continue
+        ratio = result["throughput"] / old["throughput"]
+        flag = ""
+        if ratio < 1 - threshold:
+            flag = " REGRESSION"
+            regressions += 1
+        print("%-20s %12.1f %12.1f %7.2fx%s" % (plugin, old["throughput"],
+                                                result["throughput"], ratio, flag))
+    if baseline.get("params") != results["params"]:
+        print("Note: the baseline was taken with other parameters")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=5000,
+                        help="regular files in the rootfs")
+    parser.add_argument('--packages', type=int, default=2000)
+    parser.add_argument('--cves', type=int, default=20000,
+                        help="CVEs in the NVD feed")
+    parser.add_argument('--kernels', type=int, default=20)
+    parser.add_argument('--jobs', type=int, default=0,
+                        help="ISA_config.jobs, number of CPUs if 0")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--plugins', default=",".join(plugins))
+    parser.add_argument('--workdir', help="keep the inputs and outputs there")
+    parser.add_argument('-o', '--output', help="save the results as JSON")
+    parser.add_argument('--compare', help="results JSON to compare with")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="throughput drop reported as a regression")
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    parser.add_argument('--generate', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        json.dump(run_plugin(args.run, args.workdir, args), sys.stdout)
+        return 0
+    if args.generate:
+        json.dump(generate(args.workdir, args), sys.stdout)
+        return 0
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="isafw-bench-")
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+    def run(*options):
+        output = subprocess.check_output(
+            [sys.executable, os.path.abspath(__file__), '--workdir', workdir,
+             '--files', str(args.files), '--packages', str(args.packages),
+             '--cves', str(args.cves), '--kernels', str(args.kernels), '--jobs', str(args.jobs),
+             '--seed', str(args.seed)] + list(options))
+        return json.loads(output.decode('utf-8'))
+
+    try:
+        inputs = run('--generate')
+        results = collections.OrderedDict([
+            ("revision", git_revision()),
+            ("python", sys.version.split()[0]),
+            ("cpus", multiprocessing.cpu_count()),
+            ("params", dict((k, getattr(args, k)) for k in
+                            ("files", "packages", "cves", "kernels", "jobs", "seed"))),
+            ("inputs", inputs),
+            ("plugins", collections.OrderedDict()),
+        ])
+        print("inputs: " + ", ".join("%s %d" % item for item in sorted(inputs.items())))
+        for plugin in args.plugins.split(','):
+            callback, unit = plugins[plugin]
+            result = run('--run', plugin)
+            measured = result["callbacks"].get(callback)
+            if measured and measured["wall"]:
+                result["throughput"] = inputs[unit] / measured["wall"]
+            results["plugins"][plugin] = result
+            print("\n%s: %.1f %s/s, process peak RSS %d KiB, %d errors" % (
+                plugin, result.get("throughput", 0), unit, result["process_maxrss"], result["errors"]))
+            for name, stats in sorted(result["callbacks"].items()):
+                print("  %-20s calls %6d  wall %8.3fs  cpu %8.3fs  p50 %8.2fms  max %8.2fms"
+                      "  RSS growth %d KiB" % (
+                          name, stats["calls"], stats["wall"], stats["cpu"],
+                          stats["p50"] * 1000, stats["max"] * 1000, stats["maxrss_growth"]))
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+    if args.compare:
+        with open(args.compare) as f:
+            if compare(results, json.load(f), args.threshold):
+                return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+#
+# bench_junit_xml.py - Benchmark of the JUnit XML report writers
+#
+# Copyright (c) 2015 - 2016, Intel Corporation
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Intel Corporation nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Writes the same JUnit XML report of N testcases with an lxml (or
+ElementTree) element tree and with the streaming isareport.ISA_junit,
+then prints the time and peak memory of each and whether the outputs are
+identical. Each writer runs in its own process so that the peak RSS of one
+does not hide the other.
+
+    python3 benchmarks/bench_junit_xml.py [-n N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from isafw import isareport
+
+sections = ("files_with_no_RELRO", "files_with_no_canary", "files_with_no_PIE")
+
+
+def findings(n):
+    for i in range(n):
+        item = "/usr/lib/pkg%d/lib&name<%d>.so" % (i % 97, i)
+        yield sections[i % len(sections)], item
+
+
+def write_etree(path, n):
+    try:
+        from lxml import etree
+    except ImportError:
+        import xml.etree.ElementTree as etree
+    root = etree.Element('testsuite', name='ISA_CFChecker', tests=str(n))
+    grouped = dict((s, []) for s in sections)
+    for section, item in findings(n):
+        grouped[section].append(item)
+    for section in sections:
+        for item in grouped[section]:
+            tcase = etree.SubElement(root, 'testcase', classname=section, name=item)
+            etree.SubElement(tcase, 'failure', message=item, type='violation')
+    tree = etree.ElementTree(root)
+    try:
+        tree.write(path, encoding='UTF-8', pretty_print=True, xml_declaration=True)
+    except TypeError:
+        tree.write(path, encoding='UTF-8', xml_declaration=True)
+
+
+def write_junit(path, n):
+    xml_report = isareport.ISA_junit(path, 'ISA_CFChecker', sections)
+    for section, item in findings(n):
+        xml_report.testcase(section, item, item, section=section)
+    xml_report.close()
+
+
+def run(writer, path, n, queue):
+    start = time.time()
+    writer(path, n)
+    queue.put((time.time() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+
+def measure(writer, path, n):
+    queue = multiprocessing.Queue()
+    p = multiprocessing.Process(target=run, args=(writer, path, n, queue))
+    p.start()
+    result = queue.get()
+    p.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', type=int, default=200000, help="number of testcases")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    paths = [os.path.join(tmpdir, "etree.xml"), os.path.join(tmpdir, "junit.xml")]
+    results = []
+    for label, writer, path in zip(("element tree", "streaming"), (write_etree, write_junit), paths):
+        elapsed, maxrss = measure(writer, path, args.n)
+        results.append(elapsed)
+        print("%-13s %.2fs, peak RSS %d MiB" % (label + ":", elapsed, maxrss // 1024))
+    print("speedup:      %.1fx" % (results[0] / max(results[1], 1e-9)))
+    with open(paths[0], 'rb') as a, open(paths[1], 'rb') as b:
+        identical = a.read() == b.read()
+    print("identical:    %s" % identical)
+    for path in paths:
+        os.remove(path)
+    os.rmdir(tmpdir)
+    return 0 if identical else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+#
+# bench_kca_config.py - Benchmark of the kernel .config parsing in KCA
+#
+# Copyright (c) 2015 - 2016, Intel Corporation
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Intel Corporation nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Resolves the KCA options of a kernel .config, once with the former
+substring scan of every line for every option and once with
+ISA_kca_plugin.parse_config and dict lookups. Prints the time taken by
+each and the options whose values differ.
+
+Without a config file argument an 8000 line allyesconfig-like config is
+generated. Gzipped configs such as /proc/config.gz can be passed as is.
+
+    python3 benchmarks/bench_kca_config.py [-a arch] [-r repeat] [config]
+"""
+
+from __future__ import print_function
+
+import argparse
+import gzip
+import importlib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from isafw.isaplugins import ISA_kca_plugin as kca
+
+groups = ("hardening_kco", "keys_kco", "security_kco", "integrity_kco")
+
+
+def kco_groups(arch):
+    common = importlib.import_module('isafw.isaplugins.configs.kca.common')
+    arch_module = importlib.import_module('isafw.isaplugins.configs.kca.' + arch)
+    return [kca.merge_config(getattr(arch_module, g), getattr(common, g)) for g in groups]
+
+
+def synthetic_config(keys, size=8000):
+    # every option set, options that share a prefix with the checked ones
+    # and a command line with '=' in it, the rest is filler
+    lines = ["#", "# Automatically generated file; DO NOT EDIT.", "#"]
+    for key in sorted(keys):
+        lines.append(key + "=y")
+        lines.append(key + "_BOOL=y")
+    lines.append('CONFIG_CMDLINE="console=ttyS0 root=/dev/sda"')
+    i = 0
+    while len(lines) < size:
+        if i % 3 == 0:
+            lines.append("# CONFIG_FILLER_%d is not set" % i)
+        else:
+            lines.append("CONFIG_FILLER_%d=y" % i)
+        i += 1
+    return [line + "\n" for line in lines]
+
+
+def legacy(lines, kcos):
+    for line in lines:
+        line = line.strip('\n')
+        for kco in kcos:
+            for key in kco:
+                if key + '=' in line:
+                    kco[key] = line.split('=')[1]
+    return kcos
+
+
+def current(lines, kcos):
+    options = kca.parse_config(lines)
+    for kco in kcos:
+        for key in kco:
+            if key in options:
+                kco[key] = options[key]
+    return kcos
+
+
+def timed(fn, lines, arch, repeat):
+    elapsed = 0
+    for i in range(repeat):
+        kcos = kco_groups(arch)
+        start = time.time()
+        fn(lines, kcos)
+        elapsed += time.time() - start
+    return elapsed / repeat, kcos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-a', '--arch', default='x86')
+    parser.add_argument('-r', '--repeat', type=int, default=20)
+    parser.add_argument('config', nargs='?')
+    args = parser.parse_args()
+
+    if args.config:
+        opener = gzip.open if args.config.endswith('.gz') else open
+        with opener(args.config, 'rt') as f:
+            lines = f.readlines()
+    else:
+        keys = set()
+        for kco in kco_groups(args.arch):
+            keys.update(kco)
+        lines = synthetic_config(keys)
+    print("config lines: %d, options checked: %d" %
+          (len(lines), sum(len(kco) for kco in kco_groups(args.arch))))
+    legacy_time, legacy_kcos = timed(legacy, lines, args.arch, args.repeat)
+    current_time, current_kcos = timed(current, lines, args.arch, args.repeat)
+    print("substring scan: %.2fms" % (legacy_time * 1000))
+    print("parse_config:   %.2fms" % (current_time * 1000))
+    print("speedup:        %.1fx" % (legacy_time / max(current_time, 1e-9)))
+    for group, old, new in zip(groups, legacy_kcos, current_kcos):
+        for key in sorted(old):
+            if old[key] != new[key]:
+                print("%s %s: substring scan %r, parse_config %r" % (group, key, old[key], new[key]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+#
+# bench_plugin_import.py - Benchmark of the plugin imports done by isafw
+#
+# Copyright (c) 2015 - 2016, Intel Corporation
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Intel Corporation nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Measures what importing isafw costs a bitbake task, in fresh
+interpreters: once importing every plugin and initializing the enabled
+ones up front, as isaplugins and ISA used to, and once with the plugin
+manifest, where only the plugins whose callbacks get called are imported
+and initialized. Each run imports
+isafw and calls process_package() for one recipe with the given plugin
+whitelist, as do_analysesource does. Prints the median of the runs, the
+bare interpreter startup included for reference.
+
+    python3 benchmarks/bench_plugin_import.py [-r repeat] [-w whitelist]
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+libdir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib')
+
+task = """
+import sys
+sys.path.insert(0, %(libdir)r)
+from isafw import isafw
+from isafw import isaplugins
+config = isafw.ISA_config()
+config.reportdir = config.logdir = %(outdir)r
+config.timestamp = "TS"
+config.machine = "bench"
+config.jobs = 1
+config.plugin_whitelist = %(whitelist)r
+isa = isafw.ISA(config)
+if %(eager)r:
+    for module in isaplugins.__all__:
+        isaplugins.load(module)
+        name = isaplugins.plugin_name(module)
+        if not config.plugin_whitelist or name in config.plugin_whitelist:
+            isa.init_plugin(module, name)
+pkg = isafw.ISA_package()
+pkg.name = "bench"
+pkg.version = "1.0"
+pkg.licenses = ["bench:MIT"]
+isa.process_package(pkg)
+"""
+
+
+def run(code, repeat):
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        subprocess.check_call([sys.executable, '-c', code])
+        times.append(time.time() - start)
+    return sorted(times)[len(times) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--repeat', type=int, default=11)
+    parser.add_argument('-w', '--whitelist', default='ISA_LicenseChecker',
+                        help='comma separated plugin whitelist, empty for all plugins')
+    args = parser.parse_args()
+    whitelist = [w for w in args.whitelist.split(',') if w]
+
+    outdir = tempfile.mkdtemp()
+    try:
+        startup = run('pass', args.repeat)
+        params = dict(libdir=libdir, outdir=outdir, whitelist=whitelist)
+        eager = run(task % dict(params, eager=True), args.repeat)
+        lazy = run(task % dict(params, eager=False), args.repeat)
+    finally:
+        shutil.rmtree(outdir)
+    print("interpreter startup: %.1f ms" % (startup * 1000))
+    print("all plugins imported and initialized: %.1f ms" % (eager * 1000))
+    print("manifest, imported on call: %.1f ms" % (lazy * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,365 @@
+#
+# synthetic.py - Synthetic inputs for the ISA FW benchmarks
+#
+# Copyright (c) 2015 - 2016, Intel Corporation
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Intel Corporation nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Synthetic inputs for the ISA FW benchmarks.
+
+Everything is derived from a seed, so the same parameters give the same
+rootfs, recipes and kernel configs on every machine and for every commit:
+
+* make_rootfs() - a directory tree with small ELF binaries of varying
+  hardening, scripts, data files, links, setuid/setgid files and
+  world-writable files and directories
+* packages() - a stream of ISA_package recipes with licenses and patches
+* write_pkglist() - the image package list read by the license plugin
+* write_kernel_configs() - kernel .config files with the options checked
+  by the kernel plugin and filler options
+* write_nvd_feed() - an NVD JSON feed with CVEs of the recipes
+"""
+
+from __future__ import print_function
+
+import gzip
+import importlib
+import json
+import os
+import random
+import struct
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from isafw import isafw
+from isafw import isaelf
+
+# ======== ELF binaries ======== #
+
+_ehdr = '<16sHHIQQQIHHHHHH'
+_phdr = '<IIQQQQQQ'
+_shdr = '<IIQQQQIIQQ'
+_dyn = '<qQ'
+_sym = '<IBBHQQ'
+
+SHT_PROGBITS = 1
+SHT_STRTAB = 3
+SHT_DYNAMIC = 6
+STB_GLOBAL_STT_FUNC = 0x12
+
+_libc_symbols = ("printf@GLIBC_2.2.5", "malloc@GLIBC_2.2.5", "free@GLIBC_2.2.5",
+                 "memcpy@GLIBC_2.14", "strlen@GLIBC_2.2.5", "open@GLIBC_2.2.5")
+
+
+def elf_binary(rng, tag, text_size):
+    """Returns the bytes of an x86-64 ELF file.
+
+    RELRO, canary, PIE, stack permissions and the setuid/setgid symbols are
+    picked at random, in proportions that give every CFA problem list some
+    entries. The .text section never contains MPX opcodes, so objdump is
+    not needed. tag makes the file content unique.
+    """
+    pie = rng.random() < 0.6
+    library = not pie and rng.random() < 0.3
+    relro = rng.choice(("none", "partial", "full", "full"))
+    stack = rng.choice((isaelf.PF_R | isaelf.PF_W,) * 4 +
+                       (isaelf.PF_R | isaelf.PF_W | isaelf.PF_X, None))
+    symbols = list(rng.sample(_libc_symbols, 3))
+    if rng.random() < 0.7:
+        symbols.append("__stack_chk_fail@GLIBC_2.4")
+    if rng.random() < 0.1:
+        symbols += ["setuid@GLIBC_2.2.5", "setgid@GLIBC_2.2.5"]
+        if rng.random() < 0.5:
+            symbols.append("initgroups@GLIBC_2.2.5")
+
+    dynamic = []
+    if pie:
+        dynamic += [(isaelf.DT_DEBUG, 0), (isaelf.DT_FLAGS_1, isaelf.DF_1_PIE)]
+    if relro == "full":
+        dynamic.append((isaelf.DT_BIND_NOW, 0))
+    dynamic.append((isaelf.DT_NULL, 0))
+
+    dynstr = b'\0'
+    name_offsets = []
+    for name in symbols + [tag]:
+        name_offsets.append(len(dynstr))
+        dynstr += name.encode('utf-8') + b'\0'
+    dynsym = struct.pack(_sym, 0, 0, 0, 0, 0, 0)
+    for offset in name_offsets[:-1]:
+        dynsym += struct.pack(_sym, offset, STB_GLOBAL_STT_FUNC, 0, isaelf.SHN_UNDEF, 0, 0)
+    text = b'\x90' * (text_size - 1) + b'\xc3'
+
+    segments = [isaelf.PT_DYNAMIC]
+    if relro != "none":
+        segments.append(isaelf.PT_GNU_RELRO)
+    if stack is not None:
+        segments.append(isaelf.PT_GNU_STACK)
+    phoff = struct.calcsize(_ehdr)
+    dynamic_offset = phoff + len(segments) * struct.calcsize(_phdr)
+    dynamic_data = b''.join(struct.pack(_dyn, tag_, value) for tag_, value in dynamic)
+    dynstr_offset = dynamic_offset + len(dynamic_data)
+    dynsym_offset = dynstr_offset + len(dynstr)
+    text_offset = dynsym_offset + len(dynsym)
+    shstrtab = b'\0.dynstr\0.dynsym\0.text\0.dynamic\0.shstrtab\0'
+    shstrtab_offset = text_offset + len(text)
+    shoff = shstrtab_offset + len(shstrtab)
+
+    phdrs = b''
+    for p_type in segments:
+        if p_type == isaelf.PT_DYNAMIC:
+            phdrs += struct.pack(_phdr, p_type, isaelf.PF_R | isaelf.PF_W, dynamic_offset,
+                                 0, 0, len(dynamic_data), len(dynamic_data), 8)
+        elif p_type == isaelf.PT_GNU_RELRO:
+            phdrs += struct.pack(_phdr, p_type, isaelf.PF_R, dynamic_offset,
+                                 0, 0, len(dynamic_data), len(dynamic_data), 1)
+        else:
+            phdrs += struct.pack(_phdr, p_type, stack, 0, 0, 0, 0, 0, 16)
+    shdrs = struct.pack(_shdr, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
+    shdrs += struct.pack(_shdr, 1, SHT_STRTAB, 0, 0, dynstr_offset, len(dynstr), 0, 0, 1, 0)
+    shdrs += struct.pack(_shdr, 9, isaelf.SHT_DYNSYM, 0, 0, dynsym_offset, len(dynsym),
+                         1, 1, 8, struct.calcsize(_sym))
+    shdrs += struct.pack(_shdr, 17, SHT_PROGBITS, isaelf.SHF_EXECINSTR, 0, text_offset,
+                         len(text), 0, 0, 16, 0)
+    shdrs += struct.pack(_shdr, 23, SHT_DYNAMIC, 0, 0, dynamic_offset, len(dynamic_data),
+                         1, 0, 8, struct.calcsize(_dyn))
+    shdrs += struct.pack(_shdr, 32, SHT_STRTAB, 0, 0, shstrtab_offset, len(shstrtab), 0, 0, 1, 0)
+
+    e_ident = isaelf.ELFMAG + bytearray([isaelf.ELFCLASS64, isaelf.ELFDATA2LSB, 1])
+    e_type = isaelf.ET_DYN if pie or library else isaelf.ET_EXEC
+    ehdr = struct.pack(_ehdr, bytes(e_ident), e_type, isaelf.EM_X86_64, 1, 0, phoff,
+                       shoff, 0, phoff, struct.calcsize(_phdr), len(segments),
+                       struct.calcsize(_shdr), 6, 5)
+    return ehdr + phdrs + dynamic_data + dynstr + dynsym + text + shstrtab + shdrs
+
+# ======== root filesystem ======== #
+
+_top_dirs = ("/bin", "/sbin", "/lib", "/usr/bin", "/usr/sbin", "/usr/lib",
+             "/usr/libexec", "/usr/share", "/etc", "/var/lib")
+
+
+def make_rootfs(path, files=2000, elf_ratio=0.3, seed=0):
+    """Creates a synthetic root filesystem below path.
+
+    Returns a dict with the number of objects created by kind.
+    """
+    rng = random.Random(seed)
+    counts = dict.fromkeys(("dirs", "files", "elf", "symlinks", "hardlinks",
+                            "setuid", "setgid", "ww_files", "ww_dirs"), 0)
+    dirs = list(_top_dirs)
+    for d in _top_dirs:
+        os.makedirs(path + d)
+    os.makedirs(path + "/tmp")
+    os.chmod(path + "/tmp", 0o1777)
+    counts["dirs"] = len(dirs) + 1
+    for i in range(max(1, files // 40)):
+        d = rng.choice(dirs) + "/d%d" % i
+        os.mkdir(path + d)
+        if rng.random() < 0.02:
+            os.chmod(path + d, 0o777)
+            counts["ww_dirs"] += 1
+        dirs.append(d)
+        counts["dirs"] += 1
+    regular = []
+    for i in range(files):
+        name = rng.choice(dirs) + "/f%d" % i
+        kind = rng.random()
+        mode = 0o644
+        if kind < elf_ratio:
+            data = elf_binary(rng, "synthetic-%d-%d" % (seed, i), rng.randint(256, 16384))
+            mode = 0o755
+            counts["elf"] += 1
+        elif kind < elf_ratio + 0.15:
+            data = b"#!/bin/sh\necho " + str(i).encode('ascii') + b"\n"
+            mode = 0o755
+        elif kind < elf_ratio + 0.2:
+            data = b'\x1f\x8b\x08\x00' + bytes(bytearray(rng.getrandbits(8) for _ in range(512)))
+        else:
+            data = bytes(bytearray(rng.getrandbits(8) for _ in range(rng.randint(16, 2048))))
+        special = rng.random()
+        if special < 0.01:
+            mode |= 0o4000
+            counts["setuid"] += 1
+        elif special < 0.015:
+            mode |= 0o2000
+            counts["setgid"] += 1
+        elif special < 0.02:
+            mode |= 0o002
+            counts["ww_files"] += 1
+        with open(path + name, 'wb') as f:
+            f.write(data)
+        os.chmod(path + name, mode)
+        regular.append(name)
+        counts["files"] += 1
+    for name in regular:
+        link = rng.random()
+        if link < 0.05:
+            os.symlink(os.path.basename(name), path + name + ".link")
+            counts["symlinks"] += 1
+        elif link < 0.06:
+            os.link(path + name, path + name + ".hard")
+            counts["hardlinks"] += 1
+    counts["objects"] = counts["dirs"] + counts["files"] + counts["symlinks"] + counts["hardlinks"]
+    return counts
+
+# ======== recipes and package lists ======== #
+
+# licenses as found in recipes, approved ones first
+_licenses = ("MIT", "GPL-2.0", "LGPL-2.1", "BSD-3-Clause", "Apache-2.0", "Zlib",
+             "Artistic-1.0-perl", "GPL-3.0", "LGPL-3.0", "Proprietary", "CLOSED")
+_license_weights = (20, 20, 10, 10, 10, 5, 3, 8, 5, 2, 2)
+
+
+def _cve_patch(rng):
+    year = rng.randint(2005, 2017)
+    number = rng.randint(1, 20000)
+    return rng.choice(("CVE-%d-%04d.patch", "cve-%d-%04d-fix.patch",
+                       "0001-CVE-%d-%04d.patch")) % (year, number)
+
+
+def packages(count, seed=0):
+    """Yields count ISA_package recipes."""
+    rng = random.Random(seed)
+    for i in range(count):
+        pkg = isafw.ISA_package()
+        pkg.name = "recipe%d" % i
+        pkg.version = "%d.%d.%d" % (rng.randint(0, 9), rng.randint(0, 30), rng.randint(0, 99))
+        license = rng.choices(_licenses, _license_weights)[0]
+        pkg.licenses = [pkg.name + suffix + ":" + license
+                        for suffix in ("", "-dev", "-dbg", "-doc")]
+        pkg.aliases = [pkg.name + "-alias"] if rng.random() < 0.1 else []
+        # the CVE plugin skips recipes without patches
+        pkg.patch_files = ["%04d-fix-build-%d.patch" % (j, i) for j in range(rng.randint(1, 3))]
+        pkg.patch_files += [_cve_patch(rng) for j in range(rng.randint(0, 2))]
+        yield pkg
+
+
+def write_pkglist(path, count, img_name="synthetic-image"):
+    """Writes the package list of an image holding the first count recipes."""
+    with open(path, 'w') as f:
+        f.write("Packages for image " + img_name + "\n")
+        for i in range(count):
+            f.write("recipe%d 1.0 recipe%d\n" % (i, i))
+            f.write("recipe%d-dev 1.0 recipe%d\n" % (i, i))
+
+# ======== kernel configurations ======== #
+
+_kco_groups = ("hardening_kco", "keys_kco", "security_kco", "integrity_kco")
+
+
+def kca_options(arch):
+    """Returns the options checked by the kernel plugin for arch."""
+    options = set()
+    for module in ("common", arch):
+        config = importlib.import_module('isafw.isaplugins.configs.kca.' + module)
+        for group in _kco_groups:
+            options.update(getattr(config, group))
+    return options
+
+
+def kernel_config(rng, options, size=8000):
+    """Returns the lines of a kernel .config with the checked options set
+    to random values and filler options up to size lines."""
+    lines = ["#", "# Automatically generated file; DO NOT EDIT.", "#"]
+    for key in sorted(options):
+        value = rng.choice(("y", "y", "n", "m", None))
+        if key == "CONFIG_CMDLINE":
+            lines.append('CONFIG_CMDLINE="console=ttyS0 root=/dev/sda"')
+        elif key == "CONFIG_DEFAULT_SECURITY":
+            lines.append('CONFIG_DEFAULT_SECURITY="%s"' % rng.choice(("selinux", "smack", "")))
+        elif value is None:
+            lines.append("# %s is not set" % key)
+        else:
+            lines.append(key + "=" + value)
+    i = 0
+    while len(lines) < size:
+        if rng.random() < 0.3:
+            lines.append("# CONFIG_FILLER_%d is not set" % i)
+        else:
+            lines.append("CONFIG_FILLER_%d=%s" % (i, rng.choice(("y", "m", "0x1000", '"x"'))))
+        i += 1
+    return [line + "\n" for line in lines]
+
+
+def write_kernel_configs(path, count, arch="x86", size=8000, seed=0):
+    """Writes count kernel configs to path and returns their file names."""
+    rng = random.Random(seed)
+    options = kca_options(arch)
+    names = []
+    for i in range(count):
+        name = os.path.join(path, "config-%d" % i)
+        with open(name, 'w') as f:
+            f.writelines(kernel_config(rng, options, size))
+        names.append(name)
+    return names
+
+# ======== NVD feeds ======== #
+
+
+def _cpe_match(rng, product):
+    match = {"vulnerable": True}
+    if rng.random() < 0.3:
+        match["cpe23Uri"] = "cpe:2.3:a:%s:%s:%d.%d.%d:*:*:*:*:*:*:*" % (
+            product, product, rng.randint(0, 9), rng.randint(0, 30), rng.randint(0, 99))
+        return match
+    match["cpe23Uri"] = "cpe:2.3:a:%s:%s:*:*:*:*:*:*:*:*" % (product, product)
+    if rng.random() < 0.5:
+        match["versionStartIncluding"] = "%d.0" % rng.randint(0, 4)
+    end = "%d.%d" % (rng.randint(0, 9), rng.randint(0, 30))
+    if rng.random() < 0.5:
+        match["versionEndExcluding"] = end
+    else:
+        match["versionEndIncluding"] = end
+    return match
+
+
+def write_nvd_feed(path, cves, packages, seed=0):
+    """Writes a gzipped NVD JSON 1.1 feed with cves CVEs, each affecting
+    versions of one or two of the first packages recipes."""
+    rng = random.Random(seed)
+    items = []
+    for i in range(cves):
+        products = ["recipe%d" % rng.randrange(packages) for j in range(rng.randint(1, 2))]
+        items.append({
+            "cve": {
+                "CVE_data_meta": {"ID": "CVE-%d-%04d" % (2005 + i % 13, i)},
+                "description": {"description_data": [
+                    {"lang": "en", "value": "Synthetic vulnerability %d" % i}]},
+            },
+            "configurations": {"CVE_data_version": "4.0", "nodes": [
+                {"operator": "OR", "cpe_match": [_cpe_match(rng, p) for p in products]}]},
+            "impact": {"baseMetricV2": {"cvssV2": {"baseScore": rng.randint(10, 100) / 10.0}}},
+            "publishedDate": "2016-01-01T00:00Z",
+            "lastModifiedDate": "2016-%02d-01T00:00Z" % rng.randint(1, 12),
+        })
+    feed = {
+        "CVE_data_type": "CVE",
+        "CVE_data_format": "MITRE",
+        "CVE_data_version": "4.0",
+        "CVE_data_numberOfCVEs": str(cves),
+        "CVE_data_timestamp": "2017-01-01T00:00Z",
+        "CVE_Items": items,
+    }
+    with gzip.open(path, 'wb') as f:
+        f.write(json.dumps(feed).encode('utf-8'))
@@ -31,10 +31,18 @@
 Current Contents:
 
 * isafw.py - main class
+* isaelf.py - in-process ELF reader used by the plugins
+* isacache.py - results cache kept between builds
+* isareport.py - buffered writers for reports and logs
+* isanvd.py - offline index of the NVD CVE feeds
 * plugins - ISA plugins
 * plugins/configs - configuration data for the plugins
 """
 
 __all__ = [
     'isafw',
+    'isaelf',
+    'isacache',
+    'isareport',
+    'isanvd',
 ]
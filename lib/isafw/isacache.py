@@ -0,0 +1,131 @@
+#
+# isacache.py - Persistent result cache, part of ISA FW
+#
+# Copyright (c) 2015 - 2016, Intel Corporation
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Intel Corporation nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Results cache kept between builds.
+
+Every user gets its own table in one sqlite database under
+ISA_config.cachedir. A table is tagged with a version string: opening it
+with a different version (new checker logic, new tool, new data feed)
+drops all of its entries. The number of entries is bounded and the least
+recently used ones are evicted on commit().
+"""
+
+import errno
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+cache_db = "isafw_cache.db"
+# default bound on the number of entries per table
+max_entries = 100000
+
+
+def sha256_file(file_name, blocksize=1 << 20):
+    digest = hashlib.sha256()
+    with open(file_name, 'rb') as f:
+        block = f.read(blocksize)
+        while block:
+            digest.update(block)
+            block = f.read(blocksize)
+    return digest.hexdigest()
+
+
+class ISA_cache:
+
+    def __init__(self, cachedir, name, version, max_entries=max_entries):
+        try:
+            os.makedirs(cachedir)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+        self.name = name
+        self.version = str(version)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._touched = {}
+        self._new = {}
+        # several bitbake tasks may share the database, and lookups may run
+        # in a different thread than the one that opened it
+        self.db = sqlite3.connect(os.path.join(cachedir, cache_db), timeout=60,
+                                  check_same_thread=False)
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS cache_versions '
+                            '(name TEXT PRIMARY KEY, version TEXT)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS "%s" '
+                            '(key TEXT PRIMARY KEY, value TEXT, atime REAL)' % name)
+            row = self.db.execute('SELECT version FROM cache_versions WHERE name = ?',
+                                  (name,)).fetchone()
+            if not row or row[0] != self.version:
+                self._clear()
+
+    def _clear(self):
+        self.db.execute('DELETE FROM "%s"' % self.name)
+        self.db.execute('INSERT OR REPLACE INTO cache_versions VALUES (?, ?)',
+                        (self.name, self.version))
+
+    def clear(self):
+        with self.db:
+            self._clear()
+        self._touched = {}
+        self._new = {}
+
+    def get(self, key):
+        if key in self._new:
+            self.hits += 1
+            return self._new[key]
+        row = self.db.execute('SELECT value FROM "%s" WHERE key = ?' % self.name,
+                              (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._touched[key] = time.time()
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        self._new[key] = value
+
+    def commit(self):
+        now = time.time()
+        with self.db:
+            self.db.executemany('UPDATE "%s" SET atime = ? WHERE key = ?' % self.name,
+                                ((atime, key) for key, atime in self._touched.items()))
+            self.db.executemany('INSERT OR REPLACE INTO "%s" VALUES (?, ?, ?)' % self.name,
+                                ((key, json.dumps(value), now) for key, value in self._new.items()))
+            self.db.execute('DELETE FROM "%s" WHERE key IN (SELECT key FROM "%s" '
+                            'ORDER BY atime DESC LIMIT -1 OFFSET ?)' % (self.name, self.name),
+                            (self.max_entries,))
+        self._touched = {}
+        self._new = {}
+
+    def close(self):
+        self.commit()
+        self.db.close()
@@ -0,0 +1,389 @@
+#
+# isaelf.py - In-process ELF reader, part of ISA FW
+#
+# Copyright (c) 2015 - 2016, Intel Corporation
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Intel Corporation nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Minimal ELF reader.
+
+Only the bits needed by the compile flag analyzer are decoded: the file
+header, program headers, the dynamic section and the symbol tables
+(with GNU symbol versions). The verdict helpers at the bottom reproduce
+what checksec.sh, execstack -q and readelf -s report for the same file.
+"""
+
+import mmap
+import os
+import struct
+
+ELFMAG = b'\x7fELF'
+EI_NIDENT = 16
+ELFCLASS32 = 1
+ELFCLASS64 = 2
+ELFDATA2LSB = 1
+ELFDATA2MSB = 2
+
+ET_EXEC = 2
+ET_DYN = 3
+
+EM_386 = 3
+EM_IAMCU = 6
+EM_X86_64 = 62
+
+PT_DYNAMIC = 2
+PT_GNU_STACK = 0x6474e551
+PT_GNU_RELRO = 0x6474e552
+PF_X = 0x1
+PF_W = 0x2
+PF_R = 0x4
+
+SHT_SYMTAB = 2
+SHT_NOBITS = 8
+SHT_DYNSYM = 11
+SHT_GNU_verdef = 0x6ffffffd
+SHT_GNU_verneed = 0x6ffffffe
+SHT_GNU_versym = 0x6fffffff
+SHF_EXECINSTR = 0x4
+SHN_UNDEF = 0
+
+DT_NULL = 0
+DT_RPATH = 15
+DT_DEBUG = 21
+DT_BIND_NOW = 24
+DT_RUNPATH = 29
+DT_FLAGS = 30
+DT_FLAGS_1 = 0x6ffffffb
+DF_BIND_NOW = 0x8
+DF_1_PIE = 0x08000000
+
+VERSYM_HIDDEN = 0x8000
+VERSYM_VERSION = 0x7fff
+
+# struct layouts indexed by ELF class
+_ehdr = {ELFCLASS32: 'HHIIIIIHHHHHH', ELFCLASS64: 'HHIQQQIHHHHHH'}
+_phdr = {ELFCLASS32: 'IIIIIIII', ELFCLASS64: 'IIQQQQQQ'}
+_shdr = {ELFCLASS32: 'IIIIIIIIII', ELFCLASS64: 'IIQQQQIIQQ'}
+_dyn = {ELFCLASS32: 'iI', ELFCLASS64: 'qQ'}
+_sym = {ELFCLASS32: 'IIIBBH', ELFCLASS64: 'IBBHQQ'}
+_endian = {ELFDATA2LSB: '<', ELFDATA2MSB: '>'}
+
+# bndcl, bndcu and bndmov are 0f 1a / 0f 1b behind a mandatory f3, f2 or 66
+# prefix, possibly mixed with other legacy and REX prefixes. Executable bytes
+# without such a sequence cannot disassemble to any of them.
+_mpx_opcodes = (b'\x0f\x1a', b'\x0f\x1b')
+_mpx_mandatory = frozenset(bytearray(b'\xf2\xf3\x66'))
+_x86_prefixes = frozenset(bytearray(b'\x26\x2e\x36\x3e\x64\x65\x67\xf0\xf2\xf3\x66') +
+                          bytearray(range(0x40, 0x50)))
+_x86_max_prefixes = 14
+
+
+class ISA_elf:
+    """Decoded view of one ELF file.
+
+    Attributes are plain Python values so the object can be returned from
+    a multiprocessing worker after the underlying mapping is closed.
+    """
+
+    def __init__(self, data):
+        if data[:4] != ELFMAG:
+            raise ValueError("not an ELF file")
+        self.elf_class = ord(data[4:5])
+        endian = _endian.get(ord(data[5:6]))
+        if self.elf_class not in _ehdr or not endian:
+            raise ValueError("unsupported ELF class or data encoding")
+        self._data = data
+        self._endian = endian
+        (self.e_type, self.e_machine, _, _, e_phoff, e_shoff, _, _,
+         e_phentsize, e_phnum, e_shentsize, e_shnum, _) = self._unpack(_ehdr, EI_NIDENT)
+        self.segments = [self._unpack(_phdr, e_phoff + i * e_phentsize)
+                         for i in range(e_phnum)] if e_phoff else []
+        self.sections = [self._unpack(_shdr, e_shoff + i * e_shentsize)
+                         for i in range(e_shnum)] if e_shoff else []
+        self.segment_flags = {}
+        for seg in self.segments:
+            self.segment_flags[seg[0]] = self._p_flags(seg)
+        self.dynamic = self._read_dynamic()
+        self.symbols = self._read_symbols()
+        self.mpx_opcodes = self._find_mpx_opcodes()
+        del self._data
+
+    def _unpack(self, layout, offset):
+        fmt = self._endian + layout[self.elf_class]
+        return struct.unpack_from(fmt, self._data, offset)
+
+    def _sizeof(self, layout):
+        return struct.calcsize(self._endian + layout[self.elf_class])
+
+    def _p_flags(self, seg):
+        if self.elf_class == ELFCLASS64:
+            return seg[1]
+        return seg[6]
+
+    def _p_offset_filesz(self, seg):
+        if self.elf_class == ELFCLASS64:
+            return seg[2], seg[5]
+        return seg[1], seg[4]
+
+    def _cstring(self, offset):
+        end = self._data.find(b'\0', offset)
+        if end < 0:
+            end = len(self._data)
+        return self._data[offset:end].decode('utf-8', 'replace')
+
+    def _read_dynamic(self):
+        # readelf -d prefers the PT_DYNAMIC segment
+        offset = size = None
+        for seg in self.segments:
+            if seg[0] == PT_DYNAMIC:
+                offset, size = self._p_offset_filesz(seg)
+                break
+        if offset is None:
+            return []
+        entsize = self._sizeof(_dyn)
+        dynamic = []
+        for pos in range(offset, offset + size - entsize + 1, entsize):
+            tag, val = self._unpack(_dyn, pos)
+            if tag == DT_NULL:
+                break
+            dynamic.append((tag, val))
+        return dynamic
+
+    def _versions(self, verdef, verneed):
+        names = {}
+        for sec in (verneed, verdef):
+            if sec is None:
+                continue
+            strtab = self.sections[sec[6]][4]
+            pos = sec[4]
+            for _ in range(sec[7]):
+                if sec is verneed:
+                    _, cnt, _, aux, nxt = struct.unpack_from(
+                        self._endian + 'HHIII', self._data, pos)
+                    apos = pos + aux
+                    for _ in range(cnt):
+                        _, _, other, name, anext = struct.unpack_from(
+                            self._endian + 'IHHII', self._data, apos)
+                        names[other] = (self._cstring(strtab + name), False)
+                        if not anext:
+                            break
+                        apos += anext
+                else:
+                    _, _, ndx, cnt, _, aux, nxt = struct.unpack_from(
+                        self._endian + 'HHHHIII', self._data, pos)
+                    if cnt:
+                        name, _ = struct.unpack_from(
+                            self._endian + 'II', self._data, pos + aux)
+                        names[ndx] = (self._cstring(strtab + name), True)
+                if not nxt:
+                    break
+                pos += nxt
+        return names
+
+    def _read_symbols(self):
+        versym = verdef = verneed = None
+        for sec in self.sections:
+            if sec[1] == SHT_GNU_versym:
+                versym = sec
+            elif sec[1] == SHT_GNU_verdef:
+                verdef = sec
+            elif sec[1] == SHT_GNU_verneed:
+                verneed = sec
+        versions = self._versions(verdef, verneed)
+        entsize = self._sizeof(_sym)
+        symbols = []
+        for sec in self.sections:
+            if sec[1] not in (SHT_SYMTAB, SHT_DYNSYM):
+                continue
+            if sec[6] >= len(self.sections):
+                continue
+            strtab = self.sections[sec[6]][4]
+            count = sec[5] // entsize
+            for i in range(count):
+                sym = self._unpack(_sym, sec[4] + i * entsize)
+                name = self._cstring(strtab + sym[0])
+                if not name:
+                    continue
+                if sec[1] == SHT_DYNSYM and versym is not None and versions:
+                    ver, = struct.unpack_from(self._endian + 'H', self._data,
+                                              versym[4] + i * 2)
+                    vname, defined = versions.get(ver & VERSYM_VERSION, (None, False))
+                    # indexes 0 and 1 are the local and global scopes
+                    if vname and ver & VERSYM_VERSION > 1:
+                        shndx = sym[5] if self.elf_class == ELFCLASS32 else sym[3]
+                        if defined and shndx != SHN_UNDEF and not ver & VERSYM_HIDDEN:
+                            name += '@@' + vname
+                        else:
+                            name += '@' + vname
+                symbols.append(name)
+        return symbols
+
+    def _has_mpx_prefix(self, start, pos):
+        # walk back over the prefix bytes in front of the opcode
+        for i in range(pos - 1, max(start, pos - _x86_max_prefixes) - 1, -1):
+            byte = bytearray(self._data[i:i + 1])[0]
+            if byte not in _x86_prefixes:
+                return False
+            if byte in _mpx_mandatory:
+                return True
+        return False
+
+    def _find_mpx_opcodes(self):
+        if self.e_machine not in (EM_386, EM_IAMCU, EM_X86_64):
+            return False
+        for sec in self.sections:
+            if sec[1] == SHT_NOBITS or not sec[2] & SHF_EXECINSTR:
+                continue
+            start, end = sec[4], sec[4] + sec[5]
+            for op in _mpx_opcodes:
+                pos = self._data.find(op, start, end)
+                while pos >= 0:
+                    if self._has_mpx_prefix(start, pos):
+                        return True
+                    pos = self._data.find(op, pos + 1, end)
+        return False
+
+    def dynamic_tags(self):
+        return set(tag for tag, _ in self.dynamic)
+
+    def dynamic_value(self, tag, default=0):
+        for t, val in self.dynamic:
+            if t == tag:
+                return val
+        return default
+
+
+# enough for the ELF identification and the whole ELF64 file header
+MAGIC_SIZE = 64
+
+_magics = (
+    (b'#!', 'script'),
+    (b'\x1f\x8b', 'archive'),              # gzip
+    (b'BZh', 'archive'),                   # bzip2
+    (b'\xfd7zXZ\x00', 'archive'),          # xz
+    (b'\x28\xb5\x2f\xfd', 'archive'),      # zstd
+    (b'PK\x03\x04', 'archive'),            # zip, jar
+    (b'!<arch>\n', 'archive'),             # static libraries
+)
+
+
+def classify(header):
+    """Classify a file from its first MAGIC_SIZE bytes.
+
+    Returns 'elf', 'script', 'archive' or 'data'.
+    """
+    if (header[:4] == ELFMAG and len(header) >= EI_NIDENT and
+            ord(header[4:5]) in _ehdr and ord(header[5:6]) in _endian):
+        return 'elf'
+    for magic, kind in _magics:
+        if header.startswith(magic):
+            return kind
+    return 'data'
+
+
+def classify_file(file_name):
+    """classify() for a path, None if the file cannot be read."""
+    try:
+        with open(file_name, 'rb') as f:
+            return classify(f.read(MAGIC_SIZE))
+    except (IOError, OSError):
+        return None
+
+
+def read_elf(file_name):
+    """Return an ISA_elf for file_name, or None if it is not a readable ELF."""
+    try:
+        with open(file_name, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < EI_NIDENT:
+                return None
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (IOError, OSError, ValueError):
+        return None
+    try:
+        return ISA_elf(data)
+    except (struct.error, ValueError, IndexError, OverflowError):
+        return None
+    finally:
+        data.close()
+
+# ======== verdicts equivalent to the external tools ======== #
+
+
+def security_flags(elf):
+    """Same fields as the per-file line of checksec.sh --file."""
+    tags = elf.dynamic_tags()
+    flags = []
+    if PT_GNU_RELRO not in elf.segment_flags:
+        flags.append("No RELRO")
+    elif DT_BIND_NOW in tags or elf.dynamic_value(DT_FLAGS) & DF_BIND_NOW:
+        flags.append("Full RELRO")
+    else:
+        flags.append("Partial RELRO")
+    if any("__stack_chk_fail" in s for s in elf.symbols):
+        flags.append("Canary found")
+    else:
+        flags.append("No canary found")
+    stack = elf.segment_flags.get(PT_GNU_STACK, 0)
+    if stack & (PF_R | PF_W | PF_X) == (PF_R | PF_W | PF_X):
+        flags.append("NX disabled")
+    else:
+        flags.append("NX enabled")
+    if elf.e_type == ET_EXEC:
+        flags.append("No PIE")
+    elif elf.e_type == ET_DYN:
+        if DT_DEBUG in tags or elf.dynamic_value(DT_FLAGS_1) & DF_1_PIE:
+            flags.append("PIE enabled")
+        else:
+            flags.append("DSO")
+    else:
+        flags.append("Not an ELF file")
+    flags.append("RPATH" if DT_RPATH in tags else "No RPATH")
+    flags.append("RUNPATH" if DT_RUNPATH in tags else "No RUNPATH")
+    return flags
+
+
+def execstack(elf):
+    """Same verdict as execstack -q: 'execstack', 'not_defined' or ''."""
+    if PT_GNU_STACK not in elf.segment_flags:
+        return "not_defined"
+    if elf.segment_flags[PT_GNU_STACK] & PF_X:
+        return "execstack"
+    return ""
+
+
+def symbol_names(elf):
+    """Versioned symbol names as printed by readelf -s, one per line."""
+    return "\n".join(elf.symbols)
+
+
+def no_mpx(elf):
+    """True if the file cannot contain MPX instructions, None if unsure.
+
+    Only x86 code can carry MPX bounds instructions. For x86 files that do
+    contain the prefixed opcode bytes a disassembler has to make the final
+    call.
+    """
+    if not elf.mpx_opcodes:
+        return True
+    return None
@@ -28,14 +28,25 @@
 
 from __future__ import absolute_import, print_function
 
+import atexit
+import collections
+import copy
+import os
+import re
+import resource
 import sys
+import threading
+import time
 import traceback
+from stat import S_ISDIR
 try:
     # absolute import
     import isafw.isaplugins as isaplugins
+    import isafw.isareport as isareport
 except ImportError:
     # relative import when installing as separate modules
     import isaplugins
+    import isareport
 try:
     from bb import error
 except ImportError:
@@ -47,6 +58,7 @@ __all__ = [
     'ISA_kernel',
     'ISA_filesystem',
     'ISA_config',
+    'ISA_executor',
     'ISA',
 ]
 
@@ -83,6 +95,7 @@ class ISA_kernel:
     img_name = ""
     # path to the kernel config file      (mandatory argument)
     path_to_config = ""
+    arch = ""                     # target architecture, ISA_config.arch if empty
 
 # filesystem
 
@@ -93,6 +106,124 @@ class ISA_filesystem:
     type = ""                     # filesystem type
     # path to the fs location             (mandatory argument)
     path_to_fs = ""
+    _fsobjects = None             # walk shared with the other plugins, see ISA_fsobjects
+    _reader = 0                   # reader of this plugin in _fsobjects
+
+    def fsobjects(self):
+        # the plugins of one process_filesystem call share one walk of
+        # path_to_fs, see ISA_fsobjects
+        if self._fsobjects is None or self._fsobjects.path_to_fs != self.path_to_fs:
+            return scan_fsobjects(self.path_to_fs)
+        return self._fsobjects.reader(self._reader)
+
+
+def scan_fsobjects(path_to_fs):
+    # Yields (path, lstat result) for everything below path_to_fs, with
+    # path relative to path_to_fs and starting with "/". A directory comes
+    # right before its contents. Symlinks are not followed.
+    stack = [("", None)]
+    while stack:
+        rel, st = stack.pop()
+        if rel:
+            yield rel, st
+        try:
+            entries = os.scandir(path_to_fs + rel)
+        except OSError:
+            continue
+        subdirs = []
+        with entries:
+            for entry in entries:
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                if S_ISDIR(st.st_mode):
+                    subdirs.append((rel + "/" + entry.name, st))
+                else:
+                    yield rel + "/" + entry.name, st
+        stack.extend(reversed(subdirs))
+
+
+class ISA_fsobjects:
+    # One scan_fsobjects() walk read by a fixed number of readers, one per
+    # plugin. The reader ahead of the others drives the walk. A record is
+    # only kept until every reader has read it or has been released, so
+    # readers that keep pace need no more than a few records in memory.
+    # A reader that starts over after records were dropped walks on its own.
+
+    def __init__(self, path_to_fs, readers):
+        self.path_to_fs = path_to_fs
+        self.records = collections.deque()
+        self.first = 0                      # walk index of records[0]
+        self.positions = [0] * readers      # next walk index of each reader, None once released
+        self.complete = False
+        self._scan = scan_fsobjects(path_to_fs)
+        self._lock = threading.Lock()
+
+    def reader(self, reader):
+        with self._lock:
+            if self.first > 0 or self.positions[reader] is None:
+                self.positions[reader] = None
+                self._drop()
+                return scan_fsobjects(self.path_to_fs)
+        return self._read(reader)
+
+    def _read(self, reader):
+        i = 0
+        try:
+            while True:
+                with self._lock:
+                    if i - self.first < len(self.records):
+                        record = self.records[i - self.first]
+                    elif self.complete:
+                        return
+                    else:
+                        try:
+                            record = next(self._scan)
+                        except StopIteration:
+                            self.complete = True
+                            return
+                        self.records.append(record)
+                    i += 1
+                    self.positions[reader] = i
+                    self._drop()
+                yield record
+        finally:
+            self.release(reader)
+
+    def _drop(self):
+        # drops the records every reader is done with, the lock is held
+        active = [i for i in self.positions if i is not None]
+        end = min(active) if active else self.first + len(self.records)
+        while self.first < end:
+            self.records.popleft()
+            self.first += 1
+
+    def release(self, reader):
+        with self._lock:
+            self.positions[reader] = None
+            self._drop()
+
+    def close(self):
+        # after the call: frees the records and the walk
+        with self._lock:
+            self.positions = [None] * len(self.positions)
+            self.records.clear()
+            self._scan = None
+            self.complete = True
+
+
+def filesystem_readers(ISA_filesystem, count):
+    # A copy of ISA_filesystem for each of count plugins, reading one
+    # shared walk of path_to_fs
+    fsobjects = ISA_fsobjects(ISA_filesystem.path_to_fs, count)
+    readers = []
+    for reader in range(count):
+        view = copy.copy(ISA_filesystem)
+        view._fsobjects = fsobjects
+        view._reader = reader
+        readers.append(view)
+    return fsobjects, readers
 
 # configuration of ISAFW
 # if both whitelist and blacklist is empty, all avaliable plugins will be used
@@ -113,34 +244,288 @@ class ISA_config:
     la_plugin_image_whitelist = ""# whitelist of images for violating license checks
     la_plugin_image_blacklist = ""# blacklist of images for violating license checks
     arch = ""                     # target architecture
+    cachedir = ""                 # location of results kept between builds, no caching if empty
+    cache_max_entries = 100000    # upper bound on the number of entries of each plugin cache
+    fsa_incremental = False       # also report what changed since the last snapshot, needs cachedir
+    cve_feeds = []                # NVD JSON feeds (files or dirs) to match CVEs offline instead of with cve-check-tool
+    cve_check_db = ""             # database of cve-check-tool for the CVE results cache, ~/NVDS/nvd.db if empty
+    cve_vendors = {}              # NVD vendors by recipe name for cve_feeds, or "name:vendor" pairs separated by spaces
+    jobs = 0                      # number of worker processes, number of CPUs if 0
+    executor = None               # ISA_executor shared by the plugins, set by ISA
+    parallel_plugins = False      # run the plugins of one callback concurrently in threads
+    profile = False               # dump cProfile statistics of every plugin to reportdir
+    timings = False               # write the timings of the plugin calls to reportdir, also on with profile
+    timings_report = ""           # JSON lines with the timings of the plugin calls, set by ISA
+
+# pool of worker processes for the plugins
+
+
+class ISA_executor:
+    """Worker processes shared by all plugins and plugin calls.
+
+    The pool is started on first use and kept until shutdown(), so the
+    workers are started once no matter how many images get analysed. With
+    a single job everything runs in the calling process instead.
+    """
+
+    def __init__(self, jobs=0):
+        self.jobs = jobs or os.cpu_count() or 1
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def pool(self):
+        # multiprocessing is only imported by the tasks that use the pool
+        import multiprocessing
+        with self._lock:
+            if self._pool is None:
+                self._pool = multiprocessing.Pool(self.jobs)
+            return self._pool
+
+    def map(self, func, iterable):
+        if self.jobs == 1:
+            return [func(i) for i in iterable]
+        return self.pool().map(func, iterable)
+
+    def imap(self, func, iterable, chunksize=1):
+        if self.jobs == 1:
+            return (func(i) for i in iterable)
+        return self.pool().imap(func, iterable, chunksize)
+
+    def imap_unordered(self, func, iterable, chunksize=1):
+        if self.jobs == 1:
+            return (func(i) for i in iterable)
+        return self.pool().imap_unordered(func, iterable, chunksize)
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+# dispatch table of ISA
+
+# callbacks that ISA dispatches to the plugins, init excluded
+callbacks = (
+    "process_package",
+    "process_pkg_list",
+    "process_kernel",
+    "process_kernels",
+    "process_filesystem",
+    "process_report",
+)
+
+
+class ISA_plugin_callback:
+    # callback of one enabled plugin, resolved on its first call
+    def __init__(self, module, name):
+        self.module = module      # plugin module name
+        self.name = name          # plugin name
+        self.method = None        # the callback, once the plugin is initialized
+        self.calls = 0            # number of calls
+        self.time = 0.0           # accumulated wall time of the calls
+        self.cpu = 0.0            # accumulated CPU time of the calls, see cpu_time()
+        self.maxrss_growth = 0    # accumulated growth of the process peak RSS during the calls, in KiB
+
+
+class ISA_callback:
+    # entry of the dispatch table: the enabled plugins of one callback
+    def __init__(self, name, plugins):
+        self.name = name          # callback name
+        self.plugins = plugins    # list of ISA_plugin_callback
+        self.calls = 0            # number of calls of the callback
+        self.time = 0.0           # accumulated wall time, all plugins together
+
+
+def cpu_time():
+    # User and system time of this process and of the subprocesses it
+    # waited for. Worker processes of the executor are not included, and
+    # plugins running in parallel share the time of the process.
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def peak_rss():
+    # Peak resident set size of this process, in KiB on Linux. It never
+    # goes down: a call only shows up as the growth of the peak it causes.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def plugin_set(plugins):
+    # ISA_config plugin lists are lists or comma separated strings
+    if isinstance(plugins, str):
+        plugins = re.split(r'[,\s]+', plugins)
+    return set(p for p in plugins if p)
 
 class ISA:
     def call_plugins(self, methodname, *parameters, **keywords):
-        for name in isaplugins.__all__:
-            plugin = getattr(isaplugins, name)
-            method = getattr(plugin, methodname, None)
-            if not method:
-                # Not having init() is an error, everything else is optional.
-                if methodname == "init":
-                    error("No init() defined for plugin %s.\n"
-                          "Skipping this plugin." %
-                          (methodname, plugin.getPluginName()))
-                continue
-            if self.ISA_config.plugin_whitelist and plugin.getPluginName() not in self.ISA_config.plugin_whitelist:
+        callback = self.dispatch[methodname]
+        start = time.time()
+        calls = []
+        for plugin_callback in callback.plugins:
+            if plugin_callback.method is None:
+                plugin = self.init_plugin(plugin_callback.module, plugin_callback.name)
+                if not plugin:
+                    continue
+                plugin_callback.method = getattr(plugin, methodname)
+            calls.append(plugin_callback)
+        arguments = [parameters] * len(calls)
+        fsobjects = None
+        if methodname == "process_filesystem" and calls:
+            # every plugin reads the shared walk through its own copy, the
+            # walk forgets a record once no plugin needs it any more
+            fsobjects, readers = filesystem_readers(parameters[0], len(calls))
+            arguments = [(reader,) + parameters[1:] for reader in readers]
+
+        def call(i):
+            try:
+                return self.call_plugin(calls[i].name, methodname, calls[i].method,
+                                        *arguments[i], **keywords)
+            finally:
+                if fsobjects is not None:
+                    fsobjects.release(i)
+
+        # only one cProfile profiler can be active at a time
+        if self.ISA_config.parallel_plugins and not self.ISA_config.profile and len(calls) > 1:
+            threads = self.plugin_threads(len(calls))
+            pending = [threads.apply_async(call, (i,)) for i in range(len(calls))]
+            timings = [p.get() for p in pending]
+        else:
+            timings = [call(i) for i in range(len(calls))]
+        if fsobjects is not None:
+            fsobjects.close()
+        for plugin_callback, timing in zip(calls, timings):
+            plugin_callback.calls += 1
+            plugin_callback.time += timing[1]
+            plugin_callback.cpu += timing[2]
+            plugin_callback.maxrss_growth += timing[3]
+            self.write_timings(plugin_callback.name, methodname, timing)
+        callback.calls += 1
+        callback.time += time.time() - start
+        # reports and logs stay buffered for the duration of the call only
+        isareport.flush()
+
+    def build_dispatch(self):
+        # Resolves the whitelist, the blacklist and the callbacks of every
+        # plugin once. The manifest of isaplugins answers without importing
+        # the plugins.
+        whitelist = plugin_set(self.ISA_config.plugin_whitelist)
+        blacklist = plugin_set(self.ISA_config.plugin_blacklist)
+        enabled = []
+        for module in isaplugins.__all__:
+            name = isaplugins.plugin_name(module)
+            if whitelist and name not in whitelist:
                 continue
-            if self.ISA_config.plugin_blacklist and plugin.getPluginName() in self.ISA_config.plugin_blacklist:
+            if name in blacklist:
                 continue
-            try:
+            enabled.append((module, name))
+        self.dispatch = {}
+        for methodname in callbacks:
+            self.dispatch[methodname] = ISA_callback(methodname, [
+                ISA_plugin_callback(module, name) for module, name in enabled
+                if isaplugins.has_callback(module, methodname)])
+
+    def init_plugin(self, module, name):
+        # Plugins are imported and initialized on the first call of one of
+        # their callbacks, one after the other. Returns the plugin module,
+        # None if it can't be used.
+        if module in self.plugins:
+            return self.plugins[module]
+        self.plugins[module] = None
+        try:
+            plugin = isaplugins.load(module)
+        except:
+            error("Not able to import plugin %s:\n%s" %
+                  (name, traceback.format_exc()))
+            return None
+        method = getattr(plugin, "init", None)
+        if not method:
+            # Not having init() is an error, everything else is optional.
+            error("No init() defined for plugin %s.\n"
+                  "Skipping this plugin." % name)
+            return None
+        self.write_timings(name, "init", self.call_plugin(name, "init", method, self.ISA_config))
+        self.plugins[module] = plugin
+        return plugin
+
+    def call_plugin(self, name, methodname, method, *parameters, **keywords):
+        # Returns the start time, the wall time, the CPU time and the
+        # growth of the peak RSS of the call. Plugins running in parallel
+        # share the growth, like the CPU time. Exceptions only get logged.
+        start = time.time()
+        cpu_start = cpu_time()
+        rss_start = peak_rss()
+        try:
+            if self.ISA_config.profile:
+                self.profiler(name).runcall(method, *parameters, **keywords)
+            else:
                 method(*parameters, **keywords)
-            except:
-                error("Exception in plugin %s %s():\n%s" %
-                      (plugin.getPluginName(),
-                       methodname,
-                       traceback.format_exc()))
+        except:
+            error("Exception in plugin %s %s():\n%s" %
+                  (name,
+                   methodname,
+                   traceback.format_exc()))
+        timing = (start, time.time() - start, cpu_time() - cpu_start, peak_rss() - rss_start)
+        if self.ISA_config.profile and self.ISA_config.reportdir:
+            # statistics of all the calls of the plugin in this process so far
+            self.profiler(name).dump_stats(self.ISA_config.reportdir + "/isafw_profile_" +
+                                           name + "_" + str(os.getpid()) + ".prof")
+        return timing
+
+    def profiler(self, name):
+        import cProfile
+        profiler = self.profilers.get(name)
+        if profiler is None:
+            profiler = self.profilers[name] = cProfile.Profile()
+        return profiler
+
+    def plugin_threads(self, count):
+        # threads are enough: the plugins wait on files, subprocesses and
+        # the worker processes of the executor
+        import multiprocessing.pool
+        if self._plugin_threads is None or self._plugin_threads_count < count:
+            self.shutdown_plugin_threads()
+            self._plugin_threads = multiprocessing.pool.ThreadPool(count)
+            self._plugin_threads_count = count
+        return self._plugin_threads
+
+    def shutdown_plugin_threads(self):
+        threads, self._plugin_threads = self._plugin_threads, None
+        if threads is not None:
+            threads.close()
+            threads.join()
+
+    def write_timings(self, name, methodname, timing):
+        if self.ISA_config.timings_report:
+            isareport.json_record(self.ISA_config.timings_report, {
+                "pid": os.getpid(),
+                "plugin": name,
+                "callback": methodname,
+                "start": timing[0],
+                "wall": timing[1],
+                "cpu": timing[2],
+                "maxrss_growth": timing[3],
+                "process_maxrss": peak_rss(),
+            })
 
     def __init__(self, ISA_config):
         self.ISA_config = ISA_config
-        self.call_plugins("init", ISA_config)
+        self.executor = ISA_executor(ISA_config.jobs)
+        ISA_config.executor = self.executor
+        atexit.register(self.executor.shutdown)
+        self._plugin_threads = None
+        self._plugin_threads_count = 0
+        atexit.register(self.shutdown_plugin_threads)
+        # cProfile.Profile by plugin name, with ISA_config.profile
+        self.profilers = {}
+        if (ISA_config.timings or ISA_config.profile) and ISA_config.reportdir:
+            ISA_config.timings_report = ISA_config.reportdir + "/isafw_timings_" + \
+                ISA_config.machine + "_" + ISA_config.timestamp + ".json"
+        # plugin modules by module name, see init_plugin()
+        self.plugins = {}
+        # ISA_callback by callback name, see build_dispatch()
+        self.build_dispatch()
 
     def process_package(self, ISA_package):
         self.call_plugins("process_package", ISA_package)
@@ -151,8 +536,16 @@ class ISA:
     def process_kernel(self, ISA_kernel):
         self.call_plugins("process_kernel", ISA_kernel)
 
+    def process_kernels(self, ISA_kernels):
+        self.call_plugins("process_kernels", ISA_kernels)
+
     def process_filesystem(self, ISA_filesystem):
         self.call_plugins("process_filesystem", ISA_filesystem)
 
     def process_report(self):
         self.call_plugins("process_report")
+        self.shutdown_plugin_threads()
+        self.executor.shutdown()
+        # the report handler runs in the long lived bitbake server, the
+        # writers of this build's reports and logs must not outlive it
+        isareport.close()
@@ -0,0 +1,256 @@
+#
+# isanvd.py - Offline index of the NVD CVE feeds, part of ISA FW
+#
+# Copyright (c) 2015 - 2016, Intel Corporation
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Intel Corporation nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""Offline index of the NVD CVE feeds.
+
+ISA_nvd imports NVD JSON feeds (nvdcve-1.1-<year>.json and the modified
+and recent feeds, plain or gzipped) from local files into a sqlite
+database, with the CPE matches of every CVE indexed by product and
+vendor. A feed file is only imported again when it changed, and a CVE
+found in several feeds keeps its most recently modified entry.
+
+match() compares a package version with the versions and version ranges
+of the vulnerable CPE matches of its product name, made by the given
+vendors. vendors() lists the vendors that make a product.
+"""
+
+import errno
+import gzip
+import hashlib
+import json
+import os
+import re
+import sqlite3
+
+nvd_db = "isafw_nvd.db"
+# bump whenever the tables or their content change, the index is rebuilt
+# from the feeds
+schema_version = "2"
+
+_version_part = re.compile(r'\d+|[a-zA-Z]+')
+# alphabetic parts of a version that make it a pre-release
+_prerelease = ("alpha", "beta", "dev", "pre", "rc")
+_cpe23_split = re.compile(r'(?<!\\):')
+
+
+def version_key(version):
+    """Sort key of a version string.
+
+    Numeric parts compare as numbers and sort after alphabetic parts:
+    1.2 < 1.10, 1.0k < 1.0.1. Pre-release parts (rc, alpha, beta, pre,
+    dev) sort below the end of the version, other alphabetic parts such
+    as the letters of openssl releases above it: 1.0rc1 < 1.0 < 1.0k.
+    """
+    key = []
+    for part in _version_part.findall(version):
+        if part.isdigit():
+            key.append((3, int(part), ""))
+        else:
+            part = part.lower()
+            key.append((0 if part in _prerelease else 2, 0, part))
+    key.append((1, 0, ""))
+    return tuple(key)
+
+
+def cpe_fields(uri):
+    """Returns (part, vendor, product, version) of a CPE 2.3 or 2.2 URI."""
+    if uri.startswith("cpe:2.3:"):
+        fields = [f.replace('\\', '') for f in _cpe23_split.split(uri)[2:6]]
+    elif uri.startswith("cpe:/"):
+        fields = uri[5:].split(':')[:4]
+    else:
+        return None
+    fields += [""] * (4 - len(fields))
+    return tuple(fields)
+
+
+def cpe_matches(nodes):
+    # vulnerable CPE matches of all the configuration nodes, the operators
+    # combining them with platforms are not evaluated
+    for node in nodes:
+        for match in node.get("cpe_match", node.get("cpe", ())):
+            if match.get("vulnerable", True):
+                yield match
+        for match in cpe_matches(node.get("children", ())):
+            yield match
+
+
+def feed_items(feed):
+    """Yields (CVE id, last modified date, score, summary, matches) for
+    the CVEs of a parsed feed, matches being (vendor, product, version,
+    start including, start excluding, end including, end excluding)."""
+    for item in feed.get("CVE_Items", ()):
+        cve = item["cve"]["CVE_data_meta"]["ID"]
+        impact = item.get("impact", {})
+        score = impact.get("baseMetricV3", {}).get("cvssV3", {}).get("baseScore")
+        if score is None:
+            score = impact.get("baseMetricV2", {}).get("cvssV2", {}).get("baseScore")
+        summary = ""
+        for description in item["cve"].get("description", {}).get("description_data", ()):
+            summary = description.get("value", "")
+            break
+        matches = set()
+        for match in cpe_matches(item.get("configurations", {}).get("nodes", ())):
+            fields = cpe_fields(match.get("cpe23Uri") or match.get("cpe22Uri") or "")
+            if not fields or fields[0] not in ("a", "o"):
+                continue
+            matches.add((fields[1].lower(), fields[2].lower(), fields[3],
+                         match.get("versionStartIncluding"), match.get("versionStartExcluding"),
+                         match.get("versionEndIncluding"), match.get("versionEndExcluding")))
+        yield cve, item.get("lastModifiedDate", ""), score, summary, sorted(matches, key=str)
+
+
+def version_matches(version, match):
+    """Tells whether version is affected by a (version, start including,
+    start excluding, end including, end excluding) CPE match."""
+    cpe_version, start_incl, start_excl, end_incl, end_excl = match
+    key = version_key(version)
+    if cpe_version not in ("*", "-", ""):
+        return version == cpe_version or key == version_key(cpe_version)
+    if start_incl and key < version_key(start_incl):
+        return False
+    if start_excl and key <= version_key(start_excl):
+        return False
+    if end_incl and key > version_key(end_incl):
+        return False
+    if end_excl and key >= version_key(end_excl):
+        return False
+    return True
+
+
+def cve_key(cve):
+    # CVE-2016-1000 sorts after CVE-2016-999
+    parts = cve.split('-')
+    return tuple(int(p) if p.isdigit() else 0 for p in parts[1:]) + (cve,)
+
+
+def feed_files(feeds):
+    """Expands directories in feeds into the feed files they contain."""
+    for feed in feeds:
+        if os.path.isdir(feed):
+            for name in sorted(os.listdir(feed)):
+                if name.endswith(".json") or name.endswith(".json.gz"):
+                    yield os.path.join(feed, name)
+        else:
+            yield feed
+
+
+class ISA_nvd:
+
+    def __init__(self, dbdir):
+        try:
+            os.makedirs(dbdir)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+        self.db = sqlite3.connect(os.path.join(dbdir, nvd_db), timeout=60)
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT)')
+            row = self.db.execute("SELECT value FROM info WHERE key = 'schema'").fetchone()
+            if not row or row[0] != schema_version:
+                for table in ("feeds", "cves", "matches"):
+                    self.db.execute('DROP TABLE IF EXISTS ' + table)
+                self.db.execute("INSERT OR REPLACE INTO info VALUES ('schema', ?)", (schema_version,))
+            self.db.execute('CREATE TABLE IF NOT EXISTS feeds '
+                            '(path TEXT PRIMARY KEY, stamp TEXT, timestamp TEXT)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS cves '
+                            '(id TEXT PRIMARY KEY, modified TEXT, score REAL, summary TEXT)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS matches '
+                            '(cve TEXT, vendor TEXT, product TEXT, version TEXT, start_incl TEXT, '
+                            'start_excl TEXT, end_incl TEXT, end_excl TEXT)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS matches_product ON matches (product, vendor)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS matches_cve ON matches (cve)')
+
+    def update(self, feeds):
+        """Imports the feed files, or directories of them, that changed
+        since they were last imported. Returns the paths imported."""
+        imported = []
+        for path in feed_files(feeds):
+            path = os.path.abspath(path)
+            st = os.stat(path)
+            stamp = "%d %d" % (st.st_size, st.st_mtime_ns)
+            row = self.db.execute('SELECT stamp FROM feeds WHERE path = ?', (path,)).fetchone()
+            if row and row[0] == stamp:
+                continue
+            self.import_feed(path, stamp)
+            imported.append(path)
+        return imported
+
+    def import_feed(self, path, stamp):
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, 'rb') as f:
+            feed = json.loads(f.read().decode('utf-8'))
+        with self.db:
+            for cve, modified, score, summary, matches in feed_items(feed):
+                row = self.db.execute('SELECT modified FROM cves WHERE id = ?', (cve,)).fetchone()
+                if row and row[0] > modified:
+                    continue
+                self.db.execute('DELETE FROM matches WHERE cve = ?', (cve,))
+                self.db.execute('INSERT OR REPLACE INTO cves VALUES (?, ?, ?, ?)',
+                                (cve, modified, score, summary))
+                self.db.executemany('INSERT INTO matches VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                    ((cve,) + match for match in matches))
+            self.db.execute('INSERT OR REPLACE INTO feeds VALUES (?, ?, ?)',
+                            (path, stamp, feed.get("CVE_data_timestamp", "")))
+
+    def revision(self):
+        """Identifies the content of the index, changes with every import."""
+        digest = hashlib.sha256(schema_version.encode('utf-8'))
+        for path, stamp, timestamp in self.db.execute(
+                'SELECT path, stamp, timestamp FROM feeds ORDER BY path'):
+            digest.update(("%s %s %s\n" % (path, stamp, timestamp)).encode('utf-8'))
+        return digest.hexdigest()[:16]
+
+    def vendors(self, product):
+        """Returns the sorted vendors of the CPE matches of product."""
+        return [row[0] for row in self.db.execute(
+            'SELECT DISTINCT vendor FROM matches WHERE product = ? ORDER BY vendor',
+            (product.lower(),))]
+
+    def match(self, product, version, patched=(), vendors=None):
+        """Returns the sorted lists of the unpatched and of the patched
+        CVEs affecting version of product. Only the CPE matches of vendors
+        count, those of all vendors if it is None."""
+        query = ('SELECT cve, version, start_incl, start_excl, end_incl, end_excl '
+                 'FROM matches WHERE product = ?')
+        args = [product.lower()]
+        if vendors is not None:
+            vendors = sorted(set(v.lower() for v in vendors))
+            query += ' AND vendor IN (' + ', '.join('?' * len(vendors)) + ')'
+            args += vendors
+        cves = set()
+        for row in self.db.execute(query, args):
+            if row[0] not in cves and version_matches(version, row[1:]):
+                cves.add(row[0])
+        patched = set(patched)
+        return (sorted(cves - patched, key=cve_key),
+                sorted(cves & patched, key=cve_key))
+
+    def close(self):
+        self.db.close()
@@ -32,16 +32,31 @@ import os
 import sys
 import re
 import copy
-try:
-    from lxml import etree
-except ImportError:
-    try:
-        import xml.etree.cElementTree as etree
-    except ImportError:
-        import xml.etree.ElementTree as etree
+import collections
+import itertools
+import time
+from stat import S_ISLNK, S_ISREG
+from isafw import isaelf
+from isafw import isacache
+from isafw import isareport
 
 
 CFChecker = None
+# bump whenever the checks change so that cached results get dropped
+cache_version = 1
+# problem lists and the classname of their testcases in the XML report
+problem_classes = (
+    ("no_relro", "files_with_no_RELRO"),
+    ("partial_relro", "files_with_partial_RELRO"),
+    ("no_canary", "files_with_no_canary"),
+    ("no_pie", "files_with_no_PIE"),
+    ("execstack", "files_with_execstack"),
+    ("execstack_not_defined", "files_with_execstack_not_defined"),
+    ("nodrop_groups", "files_with_nodrop_groups"),
+    ("no_mpx", "files_with_no_mpx"),
+)
+# upper bound of the chunksize, keeps the last chunks from straggling
+max_chunksize = 64
 
 
 class ISA_CFChecker():
@@ -62,16 +77,33 @@ class ISA_CFChecker():
         self.problems_report_name = ISA_config.reportdir + \
             "/cfa_problems_report_" + ISA_config.machine + "_" + ISA_config.timestamp
         self.full_reports = ISA_config.full_reports
+        self.executor = ISA_config.executor
+        self.timings_report = ISA_config.timings_report
         self.ISA_filesystem = ""
         # check that checksec and other tools are installed
         tools_errors = _check_tools()
         if tools_errors:
-            with open(self.logfile, 'w') as flog:
+            with isareport.writer(self.logfile, 'w') as flog:
                 flog.write(tools_errors)
                 return
         self.initialized = True
-        with open(self.logfile, 'w') as flog:
+        with isareport.writer(self.logfile, 'w') as flog:
             flog.write("\nPlugin ISA_CFChecker initialized!\n")
+        self.cache = None
+        # what the workers need to open the cache themselves
+        self.cache_spec = None
+        if ISA_config.cachedir:
+            try:
+                self.cache_spec = (ISA_config.cachedir,
+                                   "%d %s" % (cache_version, _tool_version("objdump")),
+                                   ISA_config.cache_max_entries)
+                self.cache = isacache.ISA_cache(ISA_config.cachedir, "cfa",
+                                                self.cache_spec[1], self.cache_spec[2])
+            except Exception:
+                self.cache_spec = None
+                with isareport.writer(self.logfile, 'a') as flog:
+                    flog.write("Not able to open the results cache: " +
+                               str(sys.exc_info()) + "\n")
         return
 
     def process_filesystem(self, ISA_filesystem):
@@ -80,79 +112,160 @@ class ISA_CFChecker():
         img_name = self.ISA_filesystem.img_name
         if (self.initialized):
             if (img_name and fs_path):
-                with open(self.logfile, 'a') as flog:
+                with isareport.writer(self.logfile, 'a') as flog:
                     flog.write("\n\nFilesystem path is: " + fs_path)
                 if self.full_reports:
-                    with open(self.full_report_name + "_" + img_name, 'w') as ffull_report:
+                    with isareport.writer(self.full_report_name + "_" + img_name, 'w') as ffull_report:
                         ffull_report.write(
                             "Security-relevant flags for executables for image: " + img_name + '\n')
                         ffull_report.write("With rootfs location at " + fs_path + "\n\n")
-                files = self.find_files(fs_path)
-                import multiprocessing
-                pool = multiprocessing.Pool()
-                results = pool.imap(process_file_wrapper, files)
-                pool.close()
-                pool.join()
-                self.process_results(results)
+                # walk, classification, cache lookup and analysis form one
+                # lazy pipeline: the pool starts on the first ELF file found
+                hits = collections.deque()
+                files = self.lookup_cache(
+                    classify_files(fs_path, self.ISA_filesystem.fsobjects()), hits)
+                chunks = self.executor.imap_unordered(
+                    process_chunk_wrapper,
+                    ((self.cache_spec, chunk) for chunk in chunk_files(files, self.executor.jobs)))
+                results = itertools.chain.from_iterable(chunks)
+                self.tool_timings = {}
+                self.process_results(self.merge_results(hits, results))
+                self.write_tool_timings()
+                if self.cache:
+                    self.cache.commit()
+                    with isareport.writer(self.logfile, 'a') as flog:
+                        flog.write("\n\nCache hits: " + str(self.cache_hits) +
+                                   ", misses: " + str(self.cache_misses))
             else:
-                with open(self.logfile, 'a') as flog:
+                with isareport.writer(self.logfile, 'a') as flog:
                     flog.write(
                         "Mandatory arguments such as image name and path to the filesystem are not provided!\n")
                     flog.write("Not performing the call.\n")
         else:
-            with open(self.logfile, 'a') as flog:
+            with isareport.writer(self.logfile, 'a') as flog:
                 flog.write("Plugin hasn't initialized! Not performing the call.\n")
 
+    def lookup_cache(self, files, hits):
+        # Files are first looked up by their device, inode, size and mtime,
+        # which the walk already has. Passes through the files that need a
+        # worker and queues the cached results in hits. Runs in the thread
+        # feeding the worker pool, so it reads no file content: the workers
+        # look the remaining files up by the hash of their content, see
+        # process_file_cached().
+        self.stat_keys = {}
+        self.cache_hits = self.cache_misses = 0
+        for file, st in files:
+            if self.cache:
+                key = stat_key(st)
+                value = self.cache.get(key)
+                if value is not None:
+                    self.cache_hits += 1
+                    hits.append([file] + value + ["File from cache " + file])
+                    continue
+                self.stat_keys[file] = key
+            yield file
+
+    def merge_results(self, hits, results):
+        # interleaves cache hits with the fresh results and stores the latter
+        # under both of their keys
+        for result in results:
+            while hits:
+                yield hits.popleft()
+            if result and len(result) > 7:
+                digest, cached = result.pop(7)
+                if cached:
+                    self.cache_hits += 1
+                else:
+                    self.cache_misses += 1
+                if digest:
+                    self.cache.put(digest, result[1:5])
+                key = self.stat_keys.pop(result[0], None)
+                if key:
+                    self.cache.put(key, result[1:5])
+            yield result
+        while hits:
+            yield hits.popleft()
+
     def process_results(self, results):
+        # Results arrive in completion order. They are aggregated as they
+        # come and the reports are written sorted by file name at the end.
         fs_path = self.ISA_filesystem.path_to_fs
+        full_results = []
         for result in results:
             if not result:
-                with open(self.logfile, 'a') as flog:
+                with isareport.writer(self.logfile, 'a') as flog:
                     flog.write("\nError in returned result")
                 continue
-            with open(self.logfile, 'a') as flog:
+            if len(result) > 6:
+                for tool, elapsed in result[6].items():
+                    calls, total = self.tool_timings.get(tool, (0, 0.0))
+                    self.tool_timings[tool] = (calls + 1, total + elapsed)
+            with isareport.writer(self.logfile, 'a') as flog:
                 flog.write("\n\nFor file: " + str(result[0]) + "\nlog is: " + str(result[5]))
             if result[1]:
-                with open(self.logfile, 'a') as flog:
+                with isareport.writer(self.logfile, 'a') as flog:
                     flog.write("\n\nsec_field: " + str(result[1]))
                 if "No RELRO" in result[1]:
-                    self.no_relro.append(result[0].replace(fs_path, ""))
+                    self.add_problem("no_relro", result[0].replace(fs_path, ""))
                 elif "Partial RELRO" in result[1]:
-                    self.partial_relro.append(result[0].replace(fs_path, ""))
+                    self.add_problem("partial_relro", result[0].replace(fs_path, ""))
                 if "No canary found" in result[1]:
-                    self.no_canary.append(result[0].replace(fs_path, ""))
+                    self.add_problem("no_canary", result[0].replace(fs_path, ""))
                 if "No PIE" in result[1]:
-                    self.no_pie.append(result[0].replace(fs_path, ""))
+                    self.add_problem("no_pie", result[0].replace(fs_path, ""))
             if result[2]:
                 if result[2] == "execstack":
-                    self.execstack.append(result[0].replace(fs_path, ""))
+                    self.add_problem("execstack", result[0].replace(fs_path, ""))
                 elif result[2] == "not_defined":
-                    self.execstack_not_defined.append(result[0].replace(fs_path, ""))
+                    self.add_problem("execstack_not_defined", result[0].replace(fs_path, ""))
             if result[3] and (result[3] == True):
-                self.nodrop_groups.append(result[0].replace(fs_path, ""))
+                self.add_problem("nodrop_groups", result[0].replace(fs_path, ""))
             if result[4] and (result[4] == True):
-                self.no_mpx.append(result[0].replace(fs_path, ""))
-            self.write_full_report(result)
+                self.add_problem("no_mpx", result[0].replace(fs_path, ""))
+            if self.full_reports:
+                full_results.append(result[:5])
+        for problem, classname in problem_classes:
+            getattr(self, problem).sort()
+        self.write_full_report(sorted(full_results))
         self.write_report()
         self.write_report_xml()
 
-    def write_full_report(self, result):
+    def add_problem(self, problem, item):
+        getattr(self, problem).append(item)
+
+    def write_tool_timings(self):
+        # wall time of the checks, summed over the worker processes
+        if not self.timings_report:
+            return
+        for tool in sorted(self.tool_timings):
+            calls, total = self.tool_timings[tool]
+            isareport.json_record(self.timings_report, {
+                "pid": os.getpid(),
+                "plugin": "ISA_CFChecker",
+                "callback": "process_filesystem",
+                "tool": tool,
+                "calls": calls,
+                "wall": total,
+            })
+
+    def write_full_report(self, results):
         if not self.full_reports:
             return
         fs_path = self.ISA_filesystem.path_to_fs
         img_name = self.ISA_filesystem.img_name
-        with open(self.full_report_name + "_" + img_name, 'a') as ffull_report:
-            ffull_report.write('\nFile: ' + result[0].replace(fs_path, ""))
-            ffull_report.write('\nsecurity flags: ' + str(result[1]))
-            ffull_report.write('\nexecstack: ' + str(result[2]))
-            ffull_report.write('\nnodrop_groups: ' + str(result[3]))
-            ffull_report.write('\nno mpx: ' + str(result[4]))
-            ffull_report.write('\n')
+        with isareport.writer(self.full_report_name + "_" + img_name, 'a') as ffull_report:
+            for result in results:
+                ffull_report.write('\nFile: ' + result[0].replace(fs_path, ""))
+                ffull_report.write('\nsecurity flags: ' + str(result[1]))
+                ffull_report.write('\nexecstack: ' + str(result[2]))
+                ffull_report.write('\nnodrop_groups: ' + str(result[3]))
+                ffull_report.write('\nno mpx: ' + str(result[4]))
+                ffull_report.write('\n')
 
     def write_report(self):
         fs_path = self.ISA_filesystem.path_to_fs
         img_name = self.ISA_filesystem.img_name
-        with open(self.problems_report_name + "_" + img_name, 'w') as fproblems_report:
+        with isareport.writer(self.problems_report_name + "_" + img_name, 'w') as fproblems_report:
             fproblems_report.write("Report for image: " + img_name + '\n')
             fproblems_report.write("With rootfs location at " + fs_path + "\n\n")
             fproblems_report.write("Relocation Read-Only\n")
@@ -202,63 +315,13 @@ class ISA_CFChecker():
                 fproblems_report.write(item + '\n')
 
     def write_report_xml(self):
-        numTests = len(self.no_relro) + len(self.partial_relro) + len(self.no_canary) + len(self.no_pie) + \
-            len(self.execstack) + len(self.execstack_not_defined) + \
-            len(self.nodrop_groups) + len(self.no_mpx)
-        root = etree.Element('testsuite', name='ISA_CFChecker', tests=str(numTests))
-        if self.no_relro:
-            for item in self.no_relro:
-                tcase1 = etree.SubElement(
-                    root, 'testcase', classname='files_with_no_RELRO', name=item)
-                etree.SubElement(tcase1, 'failure', message=item, type='violation')
-        if self.partial_relro:
-            for item in self.partial_relro:
-                tcase1 = etree.SubElement(
-                    root, 'testcase', classname='files_with_partial_RELRO', name=item)
-                etree.SubElement(tcase1, 'failure', message=item, type='violation')
-        if self.no_canary:
-            for item in self.no_canary:
-                tcase2 = etree.SubElement(
-                    root, 'testcase', classname='files_with_no_canary', name=item)
-                etree.SubElement(tcase2, 'failure', message=item, type='violation')
-        if self.no_pie:
-            for item in self.no_pie:
-                tcase3 = etree.SubElement(
-                    root, 'testcase', classname='files_with_no_PIE', name=item)
-                etree.SubElement(tcase3, 'failure', message=item, type='violation')
-        if self.execstack:
-            for item in self.execstack:
-                tcase5 = etree.SubElement(
-                    root, 'testcase', classname='files_with_execstack', name=item)
-                etree.SubElement(tcase5, 'failure', message=item, type='violation')
-        if self.execstack_not_defined:
-            for item in self.execstack_not_defined:
-                tcase6 = etree.SubElement(
-                    root, 'testcase', classname='files_with_execstack_not_defined', name=item)
-                etree.SubElement(tcase6, 'failure', message=item, type='violation')
-        if self.nodrop_groups:
-            for item in self.nodrop_groups:
-                tcase7 = etree.SubElement(
-                    root, 'testcase', classname='files_with_nodrop_groups', name=item)
-                etree.SubElement(tcase7, 'failure', message=item, type='violation')
-        if self.no_mpx:
-            for item in self.no_mpx:
-                tcase8 = etree.SubElement(
-                    root, 'testcase', classname='files_with_no_mpx', name=item)
-                etree.SubElement(tcase8, 'failure', message=item, type='violation')
-        tree = etree.ElementTree(root)
-        output = self.problems_report_name + "_" + self.ISA_filesystem.img_name + '.xml'
-        try:
-            tree.write(output, encoding='UTF-8', pretty_print=True, xml_declaration=True)
-        except TypeError:
-            tree.write(output, encoding='UTF-8', xml_declaration=True)
-
-    def find_files(self, init_path):
-        list_of_files = []
-        for (dirpath, dirnames, filenames) in os.walk(init_path):
-            for f in filenames:
-                list_of_files.append(str(dirpath + "/" + f)[:])
-        return list_of_files
+        xml_report = isareport.ISA_junit(
+            self.problems_report_name + "_" + self.ISA_filesystem.img_name + '.xml',
+            'ISA_CFChecker', [problem for problem, classname in problem_classes])
+        for problem, classname in problem_classes:
+            for item in getattr(self, problem):
+                xml_report.testcase(classname, item, item, section=problem)
+        xml_report.close()
 
 
 def _check_tools():
@@ -272,10 +335,9 @@ def _check_tools():
                 return True
         return False
 
+    # RELRO, canary, PIE, stack and symbol checks are done in-process,
+    # objdump is still needed to look for MPX instructions
     tools = {
-        "checksec.sh": "Please install checksec from http://www.trapkit.de/tools/checksec.html\n",
-        "execstack": "Please install execstack from prelink package\n",
-        "readelf": "Please install binutils\n",
         "objdump": "Please install binutils\n",
     }
     output = ""
@@ -285,6 +347,13 @@ def _check_tools():
     return output
 
 
+def _tool_version(tool):
+    try:
+        return subprocess.check_output([tool, '--version']).decode('utf-8').splitlines()[0]
+    except:
+        return ""
+
+
 def get_info(tool, args, file_name):
     env = copy.deepcopy(os.environ)
     env['PSEUDO_UNLOAD'] = "1"
@@ -311,55 +380,123 @@ def get_security_flags(file_name):
         return re.split(r' {2,}', result)[:-1]
 
 
+# file class by (st_dev, st_ino, st_size, st_mtime), shared by symlinks and
+# hard links to the same file and kept across images
+_file_classes = {}
+
+
+def classify_files(fs_path, fsobjects):
+    # Filter over the filesystem records: only regular files (or links to
+    # them) whose first bytes carry an ELF header are worth handing to the
+    # workers. Scripts, data and archives are dropped here without forking
+    # anything. Only symlinks need an extra stat to reach their target.
+    # Yields the ELF files with the stat of their target.
+    for i, st in fsobjects:
+        file = fs_path + i
+        if S_ISLNK(st.st_mode):
+            try:
+                st = os.stat(file)
+            except OSError:
+                continue
+        if not S_ISREG(st.st_mode):
+            continue
+        key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime)
+        file_class = _file_classes.get(key)
+        if file_class is None:
+            file_class = isaelf.classify_file(file)
+            _file_classes[key] = file_class
+        if file_class == 'elf':
+            yield file, st
+
+
+def chunk_files(files, jobs):
+    # Groups the files into chunks for the workers as the walk finds them.
+    # The first chunks hold a single file, so every worker starts on the
+    # first ELF files found. The size doubles after every jobs chunks up
+    # to max_chunksize, large images pay less per task overhead.
+    chunksize = 1
+    chunks = 0
+    chunk = []
+    for file in files:
+        chunk.append(file)
+        if len(chunk) == chunksize:
+            yield chunk
+            chunk = []
+            chunks += 1
+            if chunks % jobs == 0:
+                chunksize = min(max_chunksize, chunksize * 2)
+    if chunk:
+        yield chunk
+
+
+def timed(timings, tool, func, *args):
+    # calls func, adding its wall time to timings[tool]
+    start = time.time()
+    try:
+        return func(*args)
+    finally:
+        timings[tool] = timings.get(tool, 0.0) + time.time() - start
+
+
 def process_file(file):
+    # file is known to be (a link to) an ELF file, see classify_files()
     log = "File from map " + file
-    fun_results = [file, [], "", False, False, log]
-    if not os.path.isfile(file):
+    fun_results = [file, [], "", False, False, log, {}]
+    fun_results[5] += "\nFile type: ELF"
+    checks = check_file(file, fun_results[6])
+    if checks is None:
+        fun_results[5] += "\nNot an ELF file"
         return fun_results
-    env = copy.deepcopy(os.environ)
-    env['PSEUDO_UNLOAD'] = "1"
-    # getting file type
-    cmd = ['file', '--mime-type', file]
-    try:
-        result = subprocess.check_output(cmd, env=env).decode('utf-8')
-    except:
-        fun_results[-1] += "\nNot able to decode mime type"
-        return fun_results
-    file_type = result.split()[-1]
-    # looking for links
-    if "symlink" in file_type:
-        file = os.path.realpath(file)
-        cmd = ['file', '--mime-type', file]
-        try:
-            result = subprocess.check_output(cmd, env=env).decode('utf-8')
-        except:
-            fun_results[-1] += "\nNot able to decode mime type"
-            return fun_results
-        file_type = result.split()[-1]
-    # checking security flags if applies
-    if "application" not in file_type:
-        return fun_results
-    fun_results[-1] += "\nFile type: " + file_type
-    if (("octet-stream" in file_type) or ("dosexec" in file_type) or
-            ("archive" in file_type) or ("xml" in file_type) or
-            ("gzip" in file_type) or ("postscript" in file_type) or
-            ("pdf" in file_type)):
-        return fun_results
-    fun_results[1] = get_security_flags(file)
-    tmp = get_info("execstack", '-q', file)
+    fun_results[1:5] = checks
+    return fun_results
+
+
+def _nodrop_groups(symbols):
+    if ("setgid@GLIBC" in symbols) or ("setegid@GLIBC" in symbols) or ("setresgid@GLIBC" in symbols):
+        if ("setuid@GLIBC" in symbols) or ("seteuid@GLIBC" in symbols) or ("setresuid@GLIBC" in symbols):
+            if ("setgroups@GLIBC" not in symbols) and ("initgroups@GLIBC" not in symbols):
+                return True
+    return False
+
+
+def _no_mpx(disassembly):
+    return ("bndcu" not in disassembly) and ("bndcl" not in disassembly) and ("bndmov" not in disassembly)
+
+
+def _check_elf(elf):
+    return [isaelf.security_flags(elf), isaelf.execstack(elf),
+            _nodrop_groups(isaelf.symbol_names(elf)), isaelf.no_mpx(elf)]
+
+
+def check_file(file, timings=None):
+    # one mmap of the file answers everything but MPX, which only needs
+    # objdump for x86 code that actually contains bounds opcode bytes.
+    # The wall time of each tool is added to timings.
+    if timings is None:
+        timings = {}
+    elf = timed(timings, "isaelf", isaelf.read_elf, file)
+    if elf is None:
+        return None
+    results = timed(timings, "isaelf", _check_elf, elf)
+    if results[3] is None:
+        results[3] = _no_mpx(timed(timings, "objdump", get_info, "objdump", '-d', file))
+    return results
+
+
+def check_file_tools(file, timings=None):
+    # reference implementation based on the external tools, kept to
+    # cross-check check_file()
+    if timings is None:
+        timings = {}
+    results = [timed(timings, "checksec", get_security_flags, file), "", False, False]
+    tmp = timed(timings, "execstack", get_info, "execstack", '-q', file)
     if tmp.startswith("X "):
-        fun_results[2] = "execstack"
+        results[1] = "execstack"
     elif tmp.startswith("? "):
-        fun_results[2] = "not_defined"
-    tmp = get_info("readelf", '-s', file)
-    if ("setgid@GLIBC" in tmp) or ("setegid@GLIBC" in tmp) or ("setresgid@GLIBC" in tmp):
-        if ("setuid@GLIBC" in tmp) or ("seteuid@GLIBC" in tmp) or ("setresuid@GLIBC" in tmp):
-            if ("setgroups@GLIBC" not in tmp) and ("initgroups@GLIBC" not in tmp):
-                fun_results[3] = True
-    tmp = get_info("objdump", '-d', file)
-    if ("bndcu" not in tmp) and ("bndcl" not in tmp) and ("bndmov" not in tmp):
-        fun_results[4] = True
-    return fun_results
+        results[1] = "not_defined"
+    results[2] = _nodrop_groups(timed(timings, "readelf", get_info, "readelf", '-Ws', file))
+    results[3] = _no_mpx(timed(timings, "objdump", get_info, "objdump", '-d', file))
+    return results
 
 def process_file_wrapper(file):
     # Ensures that exceptions get logged with the original backtrace.
@@ -373,6 +510,42 @@ def process_file_wrapper(file):
         isafw.error('Internal error:\n%s' % traceback.format_exc())
         raise
 
+
+def process_chunk_wrapper(task):
+    cache_spec, files = task
+    if cache_spec is None:
+        return [process_file_wrapper(file) for file in files]
+    return [process_file_cached(file, cache_spec) for file in files]
+
+
+# caches opened by the workers, by cache spec
+_worker_caches = {}
+
+
+def stat_key(st):
+    return "stat %d %d %d %d" % (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def process_file_cached(file, cache_spec):
+    # In a worker: a file the stat key missed may still have a cached
+    # result under the hash of its content, a binary rebuilt to the same
+    # bytes for instance. The hash and whether the result came from the
+    # cache are appended to the result, for merge_results().
+    try:
+        digest = isacache.sha256_file(file)
+    except (IOError, OSError):
+        digest = None
+    if digest:
+        cache = _worker_caches.get(cache_spec)
+        if cache is None:
+            cachedir, version, max_entries = cache_spec
+            cache = _worker_caches[cache_spec] = isacache.ISA_cache(
+                cachedir, "cfa", version, max_entries)
+        value = cache.get(digest)
+        if value is not None:
+            return [file] + value + ["File from cache " + file, {}, (digest, True)]
+    return process_file_wrapper(file) + [(digest, False)]
+
 # ======== supported callbacks from ISA ============ #
 
 
@@ -29,9 +29,18 @@
 import subprocess
 import os, sys
 import re
+import bisect
+import hashlib
+import shutil
+from isafw import isacache
+from isafw import isareport
+from isafw import isanvd
 
 CVEChecker = None
 pkglist = "/cve_check_tool_pkglist"
+nvd_url = "https://nvd.nist.gov/vuln/detail/"
+# bump whenever the checks change so that cached results get dropped
+cache_version = 1
 
 
 class ISA_CVEChecker:
@@ -41,11 +50,22 @@ class ISA_CVEChecker:
         self.cacert = ISA_config.cacert
         self.reportdir = ISA_config.reportdir
         self.timestamp = ISA_config.timestamp
+        self.machine = ISA_config.machine
+        self.cve_feeds = ISA_config.cve_feeds
+        if isinstance(self.cve_feeds, str):
+            self.cve_feeds = self.cve_feeds.split()
+        self.cve_vendors = vendor_map(ISA_config.cve_vendors)
+        self.cve_check_db = ISA_config.cve_check_db or \
+            os.path.join(os.path.expanduser("~"), "NVDS", "nvd.db")
+        # the feed index is kept between builds when there is a cache
+        self.nvd_dir = ISA_config.cachedir or ISA_config.reportdir
+        self.cachedir = ISA_config.cachedir
+        self.cache_max_entries = ISA_config.cache_max_entries
         self.logfile = ISA_config.logdir + "/isafw_cvelog"
         self.report_name = ISA_config.reportdir + "/cve_report_" + \
             ISA_config.machine + "_" + ISA_config.timestamp
         self.initialized = True
-        with open(self.logfile, 'a') as flog:
+        with isareport.writer(self.logfile, 'a') as flog:
             flog.write("\nPlugin ISA_CVEChecker initialized!\n")
         output = ""
         # check that cve-check-tool is installed
@@ -61,98 +81,237 @@ class ISA_CVEChecker:
                     for a in ISA_pkg.aliases:
                         alias_pkgs_faux.append(
                             a + "," + ISA_pkg.version + "," + cve_patch_info + ",\n")
-                pkglist_faux = pkglist + "_" + self.timestamp + ".faux"
-                with open(self.reportdir + pkglist_faux, 'a') as fauxfile:
-                    fauxfile.write(pkgline_faux)
-                    for a in alias_pkgs_faux:
-                        fauxfile.write(a)
+                write_faux_record(self.faux_spool(), ISA_pkg.name,
+                                  pkgline_faux + "".join(alias_pkgs_faux))
 
-                with open(self.logfile, 'a') as flog:
+                with isareport.writer(self.logfile, 'a') as flog:
                     flog.write("\npkg info: " + pkgline_faux)
             else:
                 self.initialized = False
-                with open(self.logfile, 'a') as flog:
+                with isareport.writer(self.logfile, 'a') as flog:
                     flog.write(
                         "Mandatory arguments such as pkg name, version and list of patches are not provided!\n")
                     flog.write("Not performing the call.\n")
         else:
-            with open(self.logfile, 'a') as flog:
+            with isareport.writer(self.logfile, 'a') as flog:
                 flog.write(
                     "Plugin hasn't initialized! Not performing the call.\n")
 
+    def faux_spool(self):
+        # directory of the faux records of all recipes, see write_faux_record()
+        return self.reportdir + pkglist + "_" + self.timestamp + ".d"
+
     def process_report(self):
-        if not os.path.isfile(self.reportdir + pkglist + "_" + self.timestamp + ".faux"):
+        if not os.path.isdir(self.faux_spool()):
             return
         if (self.initialized):
-            with open(self.logfile, 'a') as flog:
-                flog.write("Creating report in HTML format.\n")
-            result = self.process_report_type("html")
-
-            with open(self.logfile, 'a') as flog:
+            pkglist_faux = pkglist + "_" + self.timestamp + ".faux"
+            lines = merge_faux_records(self.faux_spool(), self.reportdir + pkglist_faux)
+            with isareport.writer(self.logfile, 'a') as flog:
+                flog.write("Merged package records, lines: " + str(lines) + "\n")
+            # the packages are matched once, the reports are all rendered
+            # from the rows of the CSV report
+            with isareport.writer(self.logfile, 'a') as flog:
                 flog.write("Creating report in CSV format.\n")
-            result = self.process_report_type("csv")
+            result, rows = self.check_packages(self.reportdir + pkglist_faux)
+            if not result:
+                self.write_report_csv(rows)
+                with isareport.writer(self.logfile, 'a') as flog:
+                    flog.write("Creating report in HTML format.\n")
+                self.write_report_html(rows)
 
-            pkglist_faux = pkglist + "_" + self.timestamp + ".faux"
             os.remove(self.reportdir + pkglist_faux)
+            shutil.rmtree(self.faux_spool())
 
-            with open(self.logfile, 'a') as flog:
+            with isareport.writer(self.logfile, 'a') as flog:
                 flog.write("Creating report in XML format.\n")
-            self.write_report_xml(result)
+            self.write_report_xml(result, rows)
 
-    def write_report_xml(self, result):
-        try:
-            from lxml import etree
-        except ImportError:
-            try:
-                import xml.etree.cElementTree as etree
-            except ImportError:
-                import xml.etree.ElementTree as etree
-        num_tests = 0
-        root = etree.Element('testsuite', name='CVE_Plugin', tests='1')
+    def write_report_xml(self, result, rows):
+        xml_report = isareport.ISA_junit(self.report_name + '.xml', 'CVE_Plugin')
 
         if result :
-            num_tests = 1
-            tcase = etree.SubElement(
-                        root, 'testcase', classname='ISA_CVEChecker', name="Error in cve-check-tool")
-            etree.SubElement( tcase, 'failure', message=result, type='violation')
+            xml_report.testcase('ISA_CVEChecker', "Error in cve-check-tool", result)
         else:
-            with open(self.report_name + ".csv", 'r') as f:
-                for line in f:
-                    num_tests += 1
-                    line = line.strip()
-                    line_sp = line.split(',', 2)
-                    if (len(line_sp) >= 3) and (line_sp[2].startswith('CVE')):
-                        tcase = etree.SubElement(
-                            root, 'testcase', classname='ISA_CVEChecker', name=line.split(',', 1)[0])
-                        etree.SubElement(
-                            tcase, 'failure', message=line, type='violation')
-                    else:
-                        tcase = etree.SubElement(
-                            root, 'testcase', classname='ISA_CVEChecker', name=line.split(',', 1)[0])
-
-        root.set('tests', str(num_tests))
-        tree = etree.ElementTree(root)
-        output = self.report_name + '.xml'
+            for row in rows:
+                if unpatched_cves(row):
+                    xml_report.testcase('ISA_CVEChecker', row[0], ",".join(row))
+                else:
+                    xml_report.testcase('ISA_CVEChecker', row[0])
+
+        xml_report.close()
+
+    def write_report_csv(self, rows):
+        with open(self.report_name + ".csv", 'w') as freport:
+            for row in rows:
+                freport.write(",".join(row) + "\n")
+
+    def write_report_html(self, rows):
+        escape = isareport.xml_escape
+        title = "CVE report for " + self.machine + ", build " + self.timestamp
+        vulnerable = [row for row in rows if unpatched_cves(row)]
+        with open(self.report_name + ".html", 'w') as freport:
+            freport.write("<!DOCTYPE html>\n<html>\n<head>\n<meta charset=\"utf-8\">\n")
+            freport.write("<title>" + escape(title) + "</title>\n</head>\n<body>\n")
+            freport.write("<h1>" + escape(title) + "</h1>\n")
+            freport.write("<p>Packages checked: %d, with unpatched CVEs: %d, unpatched CVEs: %d</p>\n" %
+                          (len(rows), len(vulnerable),
+                           sum(len(unpatched_cves(row)) for row in vulnerable)))
+            freport.write("<table>\n<tr><th>Package</th><th>Version</th>"
+                          "<th>Unpatched CVEs</th><th>Details</th></tr>\n")
+            for row in rows:
+                cves = " ".join('<a href="%s%s">%s</a>' % (nvd_url, escape(cve), escape(cve))
+                                for cve in unpatched_cves(row))
+                freport.write("<tr><td>%s</td><td>%s</td><td>%s</td><td>%s</td></tr>\n" % (
+                    escape(row[0]), escape(row[1] if len(row) > 1 else ""), cves,
+                    escape(",".join(row[3:]))))
+            freport.write("</table>\n</body>\n</html>\n")
+
+    def check_packages(self, faux_file):
+        # Returns the error, empty on success, and one row per package of
+        # faux_file. Packages with a result from an earlier build for the
+        # same version, patches and CVE data are not checked again.
+        records = read_faux_file(faux_file)
+        nvd = None
+        try:
+            if self.cve_feeds:
+                nvd = self.open_nvd()
+                revision = "nvd " + nvd.revision() + " " + hashlib.sha1(
+                    repr(sorted(self.cve_vendors.items())).encode('utf-8')).hexdigest()[:16]
+            else:
+                revision = self.cve_check_revision()
+            cache = self.open_cache(revision)
+            results = {}
+            misses = []
+            for record in records:
+                row = cache.get(record_key(record)) if cache else None
+                if row is None:
+                    misses.append(record)
+                else:
+                    results[record_key(record)] = row
+            if cache:
+                with isareport.writer(self.logfile, 'a') as flog:
+                    flog.write("Cache hits: " + str(len(results)) +
+                               ", misses: " + str(len(misses)) + "\n")
+            fresh = []
+            extra = []
+            if misses and nvd:
+                fresh = [(record, self.match_nvd(nvd, record)) for record in misses]
+            elif misses:
+                if cache:
+                    write_faux_file(faux_file, misses)
+                result, rows = self.run_cve_check_tool()
+                if result:
+                    return result, []
+                if cache and self.cve_check_revision() != revision:
+                    # the tool updated its database while it ran: the new
+                    # results belong to the new revision, the cached ones
+                    # are out of date
+                    cache.close()
+                    hits = [r for r in records if record_key(r) in results]
+                    results = {}
+                    if hits:
+                        with isareport.writer(self.logfile, 'a') as flog:
+                            flog.write("The database of cve-check-tool changed, checking the "
+                                       "cached packages again: " + str(len(hits)) + "\n")
+                        write_faux_file(faux_file, hits)
+                        result, hit_rows = self.run_cve_check_tool()
+                        if result:
+                            return result, []
+                        misses += hits
+                        rows += hit_rows
+                    cache = self.open_cache(self.cve_check_revision())
+                fresh, extra = pair_rows(misses, rows)
+            for record, row in fresh:
+                results[record_key(record)] = row
+                if cache:
+                    cache.put(record_key(record), row)
+            if cache:
+                cache.close()
+        except Exception:
+            with isareport.writer(self.logfile, 'a') as flog:
+                flog.write("Error in checking the packages: " + str(sys.exc_info()) + "\n")
+            return "Error in checking the packages: " + str(sys.exc_info()), []
+        finally:
+            if nvd:
+                nvd.close()
+        rows = [results[record_key(r)] for r in records if record_key(r) in results]
+        return "", rows + extra
+
+    def cve_check_revision(self):
+        # The state of the database of cve-check-tool, None if there is none
+        # yet. Hashing a database of hundreds of MB would take longer than
+        # the check, its size and mtime change with every update.
+        try:
+            st = os.stat(self.cve_check_db)
+        except OSError:
+            return None
+        return "%s %d %d" % (_tool_version("cve-check-tool"), st.st_size, st.st_mtime_ns)
+
+    def open_cache(self, revision):
+        # The table is tagged with the revision of the CVE data, moving to
+        # a new revision drops all results of the former one.
+        if not self.cachedir or not revision:
+            return None
         try:
-            tree.write(output, encoding='UTF-8',
-                       pretty_print=True, xml_declaration=True)
-        except TypeError:
-            tree.write(output, encoding='UTF-8', xml_declaration=True)
+            return isacache.ISA_cache(self.cachedir, "cve",
+                                      "%d %s" % (cache_version, revision),
+                                      self.cache_max_entries)
+        except Exception:
+            with isareport.writer(self.logfile, 'a') as flog:
+                flog.write("Not able to open the results cache: " +
+                           str(sys.exc_info()) + "\n")
+            return None
+
+    def open_nvd(self):
+        nvd = isanvd.ISA_nvd(self.nvd_dir)
+        try:
+            for feed in nvd.update(self.cve_feeds):
+                with isareport.writer(self.logfile, 'a') as flog:
+                    flog.write("Imported NVD feed: " + feed + "\n")
+        except Exception:
+            nvd.close()
+            raise
+        return nvd
+
+    def match_nvd(self, nvd, record):
+        # Same as a row of run_cve_check_tool() with the local NVD feeds:
+        # the name, the version, the unpatched and the patched CVEs.
+        unpatched, patched = nvd.match(record[0], record[1], record[2].split(),
+                                       self.nvd_vendors(nvd, record[0]))
+        return [record[0], record[1], " ".join(unpatched), " ".join(patched)]
 
-    def process_report_type(self, rtype):
+    def nvd_vendors(self, nvd, name):
+        # The vendors configured for the recipe. Without one, a product
+        # name made by several vendors is taken to be the one of the
+        # vendor of the same name, if there is one.
+        if name in self.cve_vendors:
+            return self.cve_vendors[name]
+        vendors = nvd.vendors(name)
+        if len(vendors) > 1:
+            if name.lower() in vendors:
+                return [name.lower()]
+            with isareport.writer(self.logfile, 'a') as flog:
+                flog.write("Product " + name + " is made by several vendors: " +
+                           " ".join(vendors) + ", matching all of them. "
+                           "Set its vendor in ISAFW_CVE_VENDORS.\n")
+        return None
+
+    def run_cve_check_tool(self):
         # now faux file is ready and we can process it
+        # Returns the error output of the tool, empty on success, and the
+        # rows of its CSV report.
         args = ""
         result = ""
+        rows = []
         tool_stderr_value = ""
         args += "cve-check-tool "
         if self.cacert:
             args += "--cacert '%s' " % self.cacert
-        if rtype != "html":
-            args += "-c "
-            rtype = "csv"
+        args += "-c "
         pkglist_faux = pkglist + "_" + self.timestamp + ".faux"
         args += "-a -t faux '" + self.reportdir + pkglist_faux + "'"
-        with open(self.logfile, 'a') as flog:
+        with isareport.writer(self.logfile, 'a') as flog:
             flog.write("Args: " + args)
         try:
             popen = subprocess.Popen(
@@ -160,39 +319,167 @@ class ISA_CVEChecker:
             result = popen.communicate()
         except:
             tool_stderr_value = "Error in executing cve-check-tool" + str(sys.exc_info())
-            with open(self.logfile, 'a') as flog:
+            with isareport.writer(self.logfile, 'a') as flog:
                 flog.write("Error in executing cve-check-tool: " +
                            str(sys.exc_info()))
         else:
             stdout_value = result[0]
             tool_stderr_value = result[1].decode('utf-8')
             if not tool_stderr_value and popen.returncode == 0:
-                report = self.report_name + "." + rtype
-                with open(report, 'wb') as freport:
-                    freport.write(stdout_value)
+                rows = parse_csv_report(stdout_value.decode('utf-8'))
             else:
                 tool_stderr_value = tool_stderr_value + \
                 "\ncve-check-tool terminated with exit code " + str(popen.returncode)
-        return tool_stderr_value
+        return tool_stderr_value, rows
 
     def process_patch_list(self, patch_files):
         patch_info = ""
-        for patch in patch_files:
-            patch1 = patch.partition("cve")
-            if (patch1[0] == patch):
-                # no cve substring, try CVE
-                patch1 = patch.partition("CVE")
-                if (patch1[0] == patch):
-                    continue
-            patchstripped = patch1[2].split('-')
-            try:
-                patch_info += " CVE-" + \
-                    patchstripped[1] + "-" + re.findall('\d+', patchstripped[2])[0]
-            except IndexError:
-                # string parsing attempt failed, so just skip this patch
-               continue
+        for cve in patch_cves(patch_files):
+            patch_info += " " + cve
         return patch_info
 
+
+# CVE ids in patch file names: CVE-2016-1234.patch, 0001-cve_2016_1234-fix.patch
+cve_pattern = re.compile(r'CVE[-_](\d{4})[-_](\d{4,})', re.IGNORECASE)
+# the CVE ids of every patch file name seen so far, the same patches
+# come up again for the native, nativesdk and multilib variants of a recipe
+patch_cve_ids = {}
+
+
+def patch_cves(patch_files):
+    # Returns the CVE ids named by the patch files, in order and without
+    # duplicates. Names not seen before are matched in one pass over all
+    # of them.
+    new = set(patch for patch in patch_files if patch not in patch_cve_ids)
+    if new:
+        add_patch_cve_ids(sorted(new))
+    cves = []
+    for patch in patch_files:
+        for cve in patch_cve_ids[patch]:
+            if cve not in cves:
+                cves.append(cve)
+    return cves
+
+
+def add_patch_cve_ids(patch_files):
+    names = [os.path.basename(patch) for patch in patch_files]
+    for patch in patch_files:
+        patch_cve_ids[patch] = ()
+    starts = [0]
+    for name in names[:-1]:
+        starts.append(starts[-1] + len(name) + 1)
+    for m in cve_pattern.finditer("\n".join(names)):
+        patch = patch_files[bisect.bisect_right(starts, m.start()) - 1]
+        patch_cve_ids[patch] += ("CVE-" + m.group(1) + "-" + m.group(2),)
+
+
+def write_faux_record(spool, name, data):
+    # Every recipe gets its own record file, so parallel bitbake tasks
+    # never write to the same file. The record is renamed into place,
+    # readers never see a partial one. Records are named after their
+    # content: a task run again with the same result replaces its record.
+    try:
+        os.makedirs(spool)
+    except OSError:
+        if not os.path.isdir(spool):
+            raise
+    record = name.replace('/', '_') + "-" + \
+        hashlib.sha1(data.encode('utf-8')).hexdigest()[:16] + ".faux"
+    tmp = os.path.join(spool, "." + record + "." + str(os.getpid()))
+    with open(tmp, 'w') as f:
+        f.write(data)
+    os.rename(tmp, os.path.join(spool, record))
+
+
+def merge_faux_records(spool, faux_file):
+    # Writes the lines of all records to faux_file, in the order of the
+    # record names and without duplicates. Returns the number of lines.
+    seen = set()
+    with open(faux_file, 'w') as fout:
+        for record in sorted(os.listdir(spool)):
+            if record.startswith('.') or not record.endswith(".faux"):
+                continue
+            with open(os.path.join(spool, record), 'r') as f:
+                for line in f:
+                    if line not in seen:
+                        seen.add(line)
+                        fout.write(line)
+    return len(seen)
+
+
+def vendor_map(vendors):
+    # ISA_config.cve_vendors: vendor lists by recipe name, or "name:vendor"
+    # pairs separated by spaces
+    if isinstance(vendors, dict):
+        return dict((name, [v] if isinstance(v, str) else list(v))
+                    for name, v in vendors.items())
+    mapping = {}
+    for pair in vendors.split():
+        name, _, vendor = pair.partition(':')
+        if name and vendor:
+            mapping.setdefault(name, []).append(vendor)
+    return mapping
+
+
+def read_faux_file(faux_file):
+    # name, version and patched CVEs of every package
+    records = []
+    with open(faux_file, 'r') as f:
+        for line in f:
+            fields = line.strip().split(',')
+            if len(fields) < 3 or not fields[0]:
+                continue
+            records.append(fields[:3])
+    return records
+
+
+def write_faux_file(faux_file, records):
+    with open(faux_file, 'w') as f:
+        for record in records:
+            f.write(",".join(record) + ",\n")
+
+
+def pair_rows(records, rows):
+    # Pairs the rows of cve-check-tool with the records they are for. Rows
+    # only tell the name and the version, the records of the same name and
+    # version are paired in the order of the rows. Returns the pairs and
+    # the rows without a record.
+    pending = {}
+    for record in records:
+        pending.setdefault((record[0], record[1]), []).append(record)
+    pairs = []
+    extra = []
+    for row in rows:
+        same = pending.get(tuple(row[:2]))
+        if same:
+            pairs.append((same.pop(0), row))
+        else:
+            extra.append(row)
+    return pairs, extra
+
+
+def record_key(record):
+    return "%s,%s,%s" % (record[0], record[1], " ".join(sorted(record[2].split())))
+
+
+def _tool_version(tool):
+    try:
+        return subprocess.check_output([tool, '--version']).decode('utf-8').splitlines()[0]
+    except:
+        return ""
+
+
+def parse_csv_report(data):
+    # one row of fields per package: name, version, unpatched CVEs
+    # separated by spaces, then whatever else the tool reports
+    return [line.strip().split(',') for line in data.splitlines() if line.strip()]
+
+
+def unpatched_cves(row):
+    if len(row) >= 3 and row[2].startswith('CVE'):
+        return row[2].split()
+    return []
+
 # ======== supported callbacks from ISA ============= #
 
 
@@ -26,17 +26,17 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 import os
+import sys
+import errno
+import gzip
+import json
 from stat import *
-try:
-    from lxml import etree
-except ImportError:
-    try:
-        import xml.etree.cElementTree as etree
-    except ImportError:
-        import xml.etree.ElementTree as etree
+from isafw import isareport
 
 
 FSAnalyzer = None
+# format of the snapshots used by the incremental mode
+snapshot_version = 1
 
 
 class ISA_FSChecker():
@@ -49,59 +49,150 @@ class ISA_FSChecker():
         self.problems_report_name = ISA_config.reportdir + \
             "/fsa_problems_report_" + ISA_config.machine + "_" + ISA_config.timestamp
         self.full_reports = ISA_config.full_reports
+        self.delta_report_name = ISA_config.reportdir + \
+            "/fsa_delta_report_" + ISA_config.machine + "_" + ISA_config.timestamp
+        self.snapshot_name = ""
+        if ISA_config.cachedir:
+            self.snapshot_name = ISA_config.cachedir + "/fsa_snapshot_" + ISA_config.machine
         self.initialized = True
         self.setuid_files = []
         self.setgid_files = []
         self.ww_files = []
         self.no_sticky_bit_ww_dirs = []
-        with open(self.logfile, 'w') as flog:
+        with isareport.writer(self.logfile, 'w') as flog:
             flog.write("\nPlugin ISA_FSChecker initialized!\n")
+        self.incremental = ISA_config.fsa_incremental
+        if self.incremental and not self.snapshot_name:
+            self.incremental = False
+            with isareport.writer(self.logfile, 'a') as flog:
+                flog.write("No cache directory is set, incremental mode is disabled.\n")
 
     def process_filesystem(self, ISA_filesystem):
         if (self.initialized):
             if (ISA_filesystem.img_name and ISA_filesystem.path_to_fs):
-                with open(self.logfile, 'a') as flog:
+                with isareport.writer(self.logfile, 'a') as flog:
                     flog.write("Analyzing filesystem at: " + ISA_filesystem.path_to_fs +
                                " for the image: " + ISA_filesystem.img_name + "\n")
-                self.files = self.find_fsobjects(ISA_filesystem.path_to_fs)
-                with open(self.logfile, 'a') as flog:
-                    flog.write("\nFilelist is: " + str(self.files))
                 if self.full_reports:
-                    with open(self.full_report_name + "_" + ISA_filesystem.img_name, 'w') as ffull_report:
+                    with isareport.writer(self.full_report_name + "_" + ISA_filesystem.img_name, 'w') as ffull_report:
                         ffull_report.write(
                             "Report for image: " + ISA_filesystem.img_name + '\n')
                         ffull_report.write(
                             "With rootfs location at " + ISA_filesystem.path_to_fs + "\n\n")
-                for f in self.files:
-                    st = os.lstat(f)
-                    i = f.replace(ISA_filesystem.path_to_fs, "")
-                    if self.full_reports:
-                        with open(self.full_report_name + "_" + ISA_filesystem.img_name, 'a') as ffull_report:
-                            ffull_report.write("File: " + i + ' mode: ' + str(oct(st.st_mode)) +
-                                               " uid: " + str(st.st_uid) + " gid: " + str(st.st_gid) + '\n')
-                    if ((st.st_mode & S_ISUID) == S_ISUID):
-                        self.setuid_files.append(i)
-                    if ((st.st_mode & S_ISGID) == S_ISGID):
-                        self.setgid_files.append(i)
-                    if ((st.st_mode & S_IWOTH) == S_IWOTH):
-                        if (((st.st_mode & S_IFDIR) == S_IFDIR) and ((st.st_mode & S_ISVTX) != S_ISVTX)):
-                            self.no_sticky_bit_ww_dirs.append(i)
-                        if (((st.st_mode & S_IFREG) == S_IFREG) and ((st.st_mode & S_IFLNK) != S_IFLNK)):
-                            self.ww_files.append(i)
+                # the reports of every image only list the problems of that image
+                for problem, title in problem_titles:
+                    setattr(self, problem, [])
+                self.xml_report = isareport.ISA_junit(
+                    self.problems_report_name + "_" + ISA_filesystem.img_name + '.xml',
+                    'FSA_Plugin', [problem for problem, title in problem_titles])
+                if self.incremental:
+                    self.process_filesystem_incremental(ISA_filesystem)
+                else:
+                    count = 0
+                    for i, st in ISA_filesystem.fsobjects():
+                        self.check_fsobject(ISA_filesystem, i, st.st_mode, st.st_uid, st.st_gid)
+                        count += 1
+                    with isareport.writer(self.logfile, 'a') as flog:
+                        flog.write("\nNumber of filesystem objects: " + str(count) + "\n")
                 self.write_problems_report(ISA_filesystem)
                 self.write_problems_report_xml(ISA_filesystem)
             else:
-                with open(self.logfile, 'a') as flog:
+                with isareport.writer(self.logfile, 'a') as flog:
                     flog.write(
                         "Mandatory arguments such as image name and path to the filesystem are not provided!\n")
                     flog.write("Not performing the call.\n")
         else:
-            with open(self.logfile, 'a') as flog:
+            with isareport.writer(self.logfile, 'a') as flog:
                 flog.write(
                     "Plugin hasn't initialized! Not performing the call.\n")
 
+    def check_fsobject(self, ISA_filesystem, i, mode, uid, gid):
+        if self.full_reports:
+            with isareport.writer(self.full_report_name + "_" + ISA_filesystem.img_name, 'a') as ffull_report:
+                ffull_report.write("File: " + i + ' mode: ' + str(oct(mode)) +
+                                   " uid: " + str(uid) + " gid: " + str(gid) + '\n')
+        for problem in fsobject_problems(mode):
+            getattr(self, problem).append(i)
+            classname, tag = problem_testcases[problem]
+            self.xml_report.testcase(classname, i, i, section=problem, tag=tag)
+
+    def process_filesystem_incremental(self, ISA_filesystem):
+        snapshot_name = self.snapshot_name + "_" + ISA_filesystem.img_name
+        previous = load_snapshot(snapshot_name, ISA_filesystem.path_to_fs)
+        with isareport.writer(self.logfile, 'a') as flog:
+            if previous is None:
+                flog.write("\nNo usable snapshot at " + snapshot_name + ", scanning everything")
+            else:
+                flog.write("\nUsing snapshot " + snapshot_name)
+        entries, changed = self.find_fsobjects_incremental(
+            ISA_filesystem.path_to_fs, previous or {})
+        with isareport.writer(self.logfile, 'a') as flog:
+            flog.write("\nObjects: " + str(len(entries) - 1) +
+                       ", directories changed: " + str(changed) + "\n")
+        for i, entry in entries.items():
+            if i:
+                self.check_fsobject(ISA_filesystem, i, entry[0], entry[1], entry[2])
+        self.write_delta_report(ISA_filesystem, previous, entries)
+        try:
+            save_snapshot(snapshot_name, ISA_filesystem.path_to_fs, entries)
+        except (IOError, OSError):
+            with isareport.writer(self.logfile, 'a') as flog:
+                flog.write("Not able to save snapshot: " + str(sys.exc_info()) + "\n")
+
+    def find_fsobjects_incremental(self, init_path, previous):
+        # Entries are (mode, uid, gid, mtime, inode), keyed by the path
+        # relative to init_path ("" is init_path itself). Every object is
+        # stat'ed again, a chmod or chown does not change the mtime of its
+        # directory. Returns the entries and the number of directories that
+        # are new or changed since the snapshot.
+        entries = {}
+        changed = 0
+        stack = [""]
+        while stack:
+            rel = stack.pop()
+            try:
+                st = os.lstat(init_path + rel)
+                dir_entries = list(os.scandir(init_path + rel))
+            except OSError:
+                continue
+            entries[rel] = _snapshot_entry(st)
+            old = previous.get(rel)
+            if not (old is not None and S_ISDIR(old[0]) and
+                    old[3] == entries[rel][3] and old[4] == entries[rel][4]):
+                changed += 1
+            subdirs = []
+            for entry in dir_entries:
+                i = rel + "/" + entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(i)
+                else:
+                    try:
+                        entries[i] = _snapshot_entry(entry.stat(follow_symlinks=False))
+                    except OSError:
+                        continue
+            stack.extend(reversed(subdirs))
+        return entries, changed
+
+    def write_delta_report(self, ISA_filesystem, previous, entries):
+        with isareport.writer(self.delta_report_name + "_" + ISA_filesystem.img_name, 'w') as fdelta_report:
+            fdelta_report.write("Report for image: " + ISA_filesystem.img_name + '\n')
+            fdelta_report.write("With rootfs location at " + ISA_filesystem.path_to_fs + "\n\n")
+            if previous is None:
+                fdelta_report.write("No previous snapshot, nothing to compare with.\n")
+                return
+            old = snapshot_problems(previous)
+            new = snapshot_problems(entries)
+            for problem, title in problem_titles:
+                fdelta_report.write("Newly introduced " + title + ":\n")
+                for item in sorted(new[problem] - old[problem]):
+                    fdelta_report.write(item + '\n')
+                fdelta_report.write("\n\nResolved " + title + ":\n")
+                for item in sorted(old[problem] - new[problem]):
+                    fdelta_report.write(item + '\n')
+                fdelta_report.write("\n\n")
+
     def write_problems_report(self, ISA_filesystem):
-        with open(self.problems_report_name + "_" + ISA_filesystem.img_name, 'w') as fproblems_report:
+        with isareport.writer(self.problems_report_name + "_" + ISA_filesystem.img_name, 'w') as fproblems_report:
             fproblems_report.write(
                 "Report for image: " + ISA_filesystem.img_name + '\n')
             fproblems_report.write(
@@ -121,50 +212,73 @@ class ISA_FSChecker():
                 fproblems_report.write(item + '\n')
 
     def write_problems_report_xml(self, ISA_filesystem):
-        num_tests = len(self.setuid_files) + len(self.setgid_files) + \
-            len(self.ww_files) + len(self.no_sticky_bit_ww_dirs)
-        root = etree.Element(
-            'testsuite', name='FSA_Plugin', tests=str(num_tests))
-        if self.setuid_files:
-            for item in self.setuid_files:
-                tcase1 = etree.SubElement(
-                    root, 'testcase', classname='Files_with_SETUID_bit_set', name=item)
-                etree.SubElement(
-                    tcase1, 'failure', message=item, type='violation')
-        if self.setgid_files:
-            for item in self.setgid_files:
-                tcase2 = etree.SubElement(
-                    root, 'testacase', classname='Files_with_SETGID_bit_set', name=item)
-                etree.SubElement(
-                    tcase2, 'failure', message=item, type='violation')
-        if self.ww_files:
-            for item in self.ww_files:
-                tcase3 = etree.SubElement(
-                    root, 'testase', classname='World-writable_files', name=item)
-                etree.SubElement(
-                    tcase3, 'failure', message=item, type='violation')
-        if self.no_sticky_bit_ww_dirs:
-            for item in self.no_sticky_bit_ww_dirs:
-                tcase4 = etree.SubElement(
-                    root, 'testcase', classname='World-writable_dirs_with_no_sticky_bit', name=item)
-                etree.SubElement(
-                    tcase4, 'failure', message=item, type='violation')
-        tree = etree.ElementTree(root)
-        output = self.problems_report_name + "_" + ISA_filesystem.img_name + '.xml'
-        try:
-            tree.write(output, encoding='UTF-8',
-                       pretty_print=True, xml_declaration=True)
-        except TypeError:
-            tree.write(output, encoding='UTF-8', xml_declaration=True)
-
-    def find_fsobjects(self, init_path):
-        list_of_files = []
-        for (dirpath, dirnames, filenames) in os.walk(init_path):
-            if (dirpath != init_path):
-                list_of_files.append(str(dirpath)[:])
-            for f in filenames:
-                list_of_files.append(str(dirpath + "/" + f)[:])
-        return list_of_files
+        self.xml_report.close()
+
+problem_titles = (
+    ("setuid_files", "files with SETUID bit set"),
+    ("setgid_files", "files with SETGID bit set"),
+    ("ww_files", "world-writable files"),
+    ("no_sticky_bit_ww_dirs", "world-writable dirs with no sticky bit"),
+)
+# classname and element of the testcases of each problem in the XML report,
+# the misspelled elements are kept so that the reports do not change
+problem_testcases = {
+    "setuid_files": ("Files_with_SETUID_bit_set", "testcase"),
+    "setgid_files": ("Files_with_SETGID_bit_set", "testacase"),
+    "ww_files": ("World-writable_files", "testase"),
+    "no_sticky_bit_ww_dirs": ("World-writable_dirs_with_no_sticky_bit", "testcase"),
+}
+
+
+def fsobject_problems(mode):
+    problems = []
+    if ((mode & S_ISUID) == S_ISUID):
+        problems.append("setuid_files")
+    if ((mode & S_ISGID) == S_ISGID):
+        problems.append("setgid_files")
+    if ((mode & S_IWOTH) == S_IWOTH):
+        if (((mode & S_IFDIR) == S_IFDIR) and ((mode & S_ISVTX) != S_ISVTX)):
+            problems.append("no_sticky_bit_ww_dirs")
+        if (((mode & S_IFREG) == S_IFREG) and ((mode & S_IFLNK) != S_IFLNK)):
+            problems.append("ww_files")
+    return problems
+
+
+def snapshot_problems(entries):
+    problems = dict((problem, set()) for problem, _ in problem_titles)
+    for i, entry in entries.items():
+        if i:
+            for problem in fsobject_problems(entry[0]):
+                problems[problem].add(i)
+    return problems
+
+
+def _snapshot_entry(st):
+    return [st.st_mode, st.st_uid, st.st_gid, st.st_mtime_ns, st.st_ino]
+
+
+def load_snapshot(snapshot_name, init_path):
+    try:
+        with gzip.open(snapshot_name, 'rt') as fsnapshot:
+            snapshot = json.load(fsnapshot)
+    except (IOError, OSError, ValueError):
+        return None
+    if snapshot.get("version") != snapshot_version or snapshot.get("path") != init_path:
+        return None
+    return snapshot["entries"]
+
+
+def save_snapshot(snapshot_name, init_path, entries):
+    try:
+        os.makedirs(os.path.dirname(snapshot_name))
+    except OSError as exc:
+        if exc.errno != errno.EEXIST:
+            raise
+    tmp_name = snapshot_name + ".tmp" + str(os.getpid())
+    with gzip.open(tmp_name, 'wt') as fsnapshot:
+        json.dump({"version": snapshot_version, "path": init_path,
+                   "entries": entries}, fsnapshot, separators=(',', ':'))
+    os.rename(tmp_name, snapshot_name)
 
 # ======== supported callbacks from ISA ============= #
 
@@ -26,16 +26,21 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-try:
-    from lxml import etree
-except ImportError:
-    try:
-        import xml.etree.cElementTree as etree
-    except ImportError:
-        import xml.etree.ElementTree as etree
+import sys
+import csv
+import collections
 import importlib
+from isafw import isareport
 
 KCAnalyzer = None
+# option groups of the config modules, in report order, with their titles
+kco_groups = (
+    ("hardening_kco", "Hardening options"),
+    ("keys_kco", "Key-related options"),
+    ("security_kco", "Security options"),
+    ("integrity_kco", "Integrity options"),
+)
+compiled_rules = {}
 
 
 class ISA_KernelChecker():
@@ -47,259 +52,234 @@ class ISA_KernelChecker():
             ISA_config.machine + "_" + ISA_config.timestamp
         self.problems_report_name = ISA_config.reportdir + \
             "/kca_problems_report_" + ISA_config.machine + "_" + ISA_config.timestamp
+        self.matrix_report_name = ISA_config.reportdir + \
+            "/kca_matrix_report_" + ISA_config.machine + "_" + ISA_config.timestamp + ".csv"
         self.full_reports = ISA_config.full_reports
+        self.executor = ISA_config.executor
         self.initialized = True
         self.arch = ISA_config.arch
-        with open(self.logfile, 'w') as flog:
+        with isareport.writer(self.logfile, 'w') as flog:
             flog.write("\nPlugin ISA_KernelChecker initialized!\n")
 
-    def append_recommendation(self, report, key, value):
+    def append_recommendation(self, report, key, value, comments):
         report.write("Recommended value:\n")
         report.write(key + ' : ' + str(value) + '\n')
-        comment = self.comments.get(key, '')
+        comment = comments.get(key, '')
         if comment != '':
             report.write("Comment:\n")
             report.write(comment + '\n')
 
     def process_kernel(self, ISA_kernel):
-        if (self.initialized):
-            if (ISA_kernel.img_name and ISA_kernel.path_to_config):
-                # Merging common and arch configs
-                common_config_module = importlib.import_module('isafw.isaplugins.configs.kca.{}'.format('common'))
-                arch_config_module = importlib.import_module('isafw.isaplugins.configs.kca.{}'.format(self.arch))
-
-                for c in ["hardening_kco", "keys_kco", "security_kco", "integrity_kco",
-                          "hardening_kco_ref", "keys_kco_ref", "security_kco_ref", "integrity_kco_ref",
-                          "comments"]:
-                    setattr(self, c, merge_config(getattr(arch_config_module, c), getattr(common_config_module, c)))
-                with open(self.logfile, 'a') as flog:
-                    flog.write("Analyzing kernel config file at: " + ISA_kernel.path_to_config +
-                               " for the image: " + ISA_kernel.img_name + "\n")
-                with open(ISA_kernel.path_to_config, 'r') as fkernel_conf:
-                    for line in fkernel_conf:
-                        line = line.strip('\n')
-                        for key in self.hardening_kco:
-                            if key + '=' in line:
-                                self.hardening_kco[key] = line.split('=')[1]
-                        for key in self.keys_kco:
-                            if key + '=' in line:
-                                self.keys_kco[key] = line.split('=')[1]
-                        for key in self.security_kco:
-                            if key + '=' in line:
-                                self.security_kco[key] = line.split('=')[1]
-                        for key in self.integrity_kco:
-                            if key + '=' in line:
-                                self.integrity_kco[key] = line.split('=')[1]
-                with open(self.logfile, 'a') as flog:
-                    flog.write("\n\nhardening_kco values: " +
-                               str(self.hardening_kco))
-                    flog.write("\n\nkeys_kco values: " + str(self.keys_kco))
-                    flog.write("\n\nsecurity_kco values: " +
-                               str(self.security_kco))
-                    flog.write("\n\nintegrity_kco values: " +
-                               str(self.integrity_kco))
-                self.write_full_report(ISA_kernel)
-                self.write_problems_report(ISA_kernel)
-
-            else:
-                with open(self.logfile, 'a') as flog:
+        self.analyse_kernels([ISA_kernel])
+
+    def process_kernels(self, ISA_kernels):
+        results = self.analyse_kernels(ISA_kernels)
+        if results:
+            self.write_matrix_report(results)
+
+    def analyse_kernels(self, ISA_kernels):
+        # Returns (ISA_kernel, findings) of every analysed kernel. Configs
+        # are evaluated by the shared workers when there is more than one.
+        if not self.initialized:
+            with isareport.writer(self.logfile, 'a') as flog:
+                flog.write(
+                    "Plugin hasn't initialized! Not performing the call!\n")
+            return []
+        kernels = []
+        for ISA_kernel in ISA_kernels:
+            if not (ISA_kernel.img_name and ISA_kernel.path_to_config):
+                with isareport.writer(self.logfile, 'a') as flog:
                     flog.write(
                         "Mandatory arguments such as image name and path to config are not provided!\n")
                     flog.write("Not performing the call.\n")
+                continue
+            arch = ISA_kernel.arch or self.arch
+            try:
+                # compiled before the workers start, so that they inherit it
+                kca_rules(arch)
+            except ImportError:
+                with isareport.writer(self.logfile, 'a') as flog:
+                    flog.write("\nNo rules for architecture " + str(arch) +
+                               ", skipping " + ISA_kernel.path_to_config + "\n")
+                continue
+            with isareport.writer(self.logfile, 'a') as flog:
+                flog.write("Analyzing kernel config file at: " + ISA_kernel.path_to_config +
+                           " for the image: " + ISA_kernel.img_name + "\n")
+            kernels.append((ISA_kernel, arch))
+        jobs = [(ISA_kernel.path_to_config, arch) for ISA_kernel, arch in kernels]
+        if len(jobs) > 1:
+            evaluated = self.executor.map(evaluate_kernel, jobs)
         else:
-            with open(self.logfile, 'a') as flog:
-                flog.write(
-                    "Plugin hasn't initialized! Not performing the call!\n")
+            evaluated = [evaluate_kernel(job) for job in jobs]
+        results = []
+        for (ISA_kernel, arch), (findings, error) in zip(kernels, evaluated):
+            if error:
+                with isareport.writer(self.logfile, 'a') as flog:
+                    flog.write("\nNot able to analyse " + ISA_kernel.path_to_config + ": " + error + "\n")
+                continue
+            with isareport.writer(self.logfile, 'a') as flog:
+                for group, title in kco_groups:
+                    flog.write("\n\n" + group + " values: " +
+                               str(dict((finding[1], finding[2]) for finding in findings
+                                        if finding[0] == title)))
+            self.write_full_report(ISA_kernel, findings)
+            self.write_problems_report(ISA_kernel, findings, kca_rules(arch).comments)
+            results.append((ISA_kernel, arch, findings))
+        return results
 
-    def write_full_report(self, ISA_kernel):
+    def write_full_report(self, ISA_kernel, findings):
         if self.full_reports:
-            with open(self.full_report_name + "_" + ISA_kernel.img_name, 'w') as freport:
+            with isareport.writer(self.full_report_name + "_" + ISA_kernel.img_name, 'w') as freport:
                 freport.write("Report for image: " +
                               ISA_kernel.img_name + '\n')
                 freport.write("With the kernel conf at: " +
-                              ISA_kernel.path_to_config + '\n\n')
-                freport.write("Hardening options:\n")
-                for key in sorted(self.hardening_kco):
-                    freport.write(
-                        key + ' : ' + str(self.hardening_kco[key]) + '\n')
-                freport.write("\nKey-related options:\n")
-                for key in sorted(self.keys_kco):
-                    freport.write(key + ' : ' + str(self.keys_kco[key]) + '\n')
-                freport.write("\nSecurity options:\n")
-                for key in sorted(self.security_kco):
-                    freport.write(
-                        key + ' : ' + str(self.security_kco[key]) + '\n')
-                freport.write("\nIntegrity options:\n")
-                for key in sorted(self.integrity_kco):
-                    freport.write(
-                        key + ' : ' + str(self.integrity_kco[key]) + '\n')
-
-    def write_problems_report(self, ISA_kernel):
-        self.write_text_problems_report(ISA_kernel)
-        self.write_xml_problems_report(ISA_kernel)
-
-    def write_text_problems_report(self, ISA_kernel):
-        with open(self.problems_report_name + "_" + ISA_kernel.img_name, 'w') as freport:
+                              ISA_kernel.path_to_config + '\n')
+                title = None
+                for finding in findings:
+                    if finding[0] != title:
+                        title = finding[0]
+                        freport.write("\n" + title + ":\n")
+                    freport.write(finding[1] + ' : ' + str(finding[2]) + '\n')
+
+    def write_problems_report(self, ISA_kernel, findings, comments):
+        self.write_text_problems_report(ISA_kernel, findings, comments)
+        self.write_xml_problems_report(ISA_kernel, findings)
+
+    def write_text_problems_report(self, ISA_kernel, findings, comments):
+        with isareport.writer(self.problems_report_name + "_" + ISA_kernel.img_name, 'w') as freport:
             freport.write("Report for image: " + ISA_kernel.img_name + '\n')
             freport.write("With the kernel conf at: " +
-                          ISA_kernel.path_to_config + '\n\n')
-            freport.write("Hardening options that need improvement:\n")
-            for key in sorted(self.hardening_kco):
-                if (self.hardening_kco[key] != self.hardening_kco_ref[key]):
-                    valid = False
-                    if (key == "CONFIG_CMDLINE"):
-                        if (len(self.hardening_kco['CONFIG_CMDLINE']) > 0):
-                            valid = True
-                    if (key == "CONFIG_DEBUG_STRICT_USER_COPY_CHECKS"):
-                        if (self.hardening_kco['CONFIG_ARCH_HAS_DEBUG_STRICT_USER_COPY_CHECKS'] == 'y'):
-                            valid = True
-                    if (key == "CONFIG_RANDOMIZE_BASE_MAX_OFFSET"):
-                        options = self.hardening_kco_ref[key].split(',')
-                        for option in options:
-                            if (option == self.hardening_kco[key]):
-                                valid = True
-                                break
-                    if not valid:
-                        freport.write("\nActual value:\n")
-                        freport.write(
-                            key + ' : ' + str(self.hardening_kco[key]) + '\n')
-                        self.append_recommendation(freport, key, self.hardening_kco_ref[key])
-            freport.write("\nKey-related options that need improvement:\n")
-            for key in sorted(self.keys_kco):
-                if (self.keys_kco[key] != self.keys_kco_ref[key]):
+                          ISA_kernel.path_to_config + '\n')
+            title = None
+            for (group_title, key, value, ref, violation) in findings:
+                if group_title != title:
+                    title = group_title
+                    freport.write("\n" + title + " that need improvement:\n")
+                if violation:
                     freport.write("\nActual value:\n")
-                    freport.write(key + ' : ' + str(self.keys_kco[key]) + '\n')
-                    self.append_recommendation(freport, key, self.keys_kco_ref[key])
-            freport.write("\nSecurity options that need improvement:\n")
-            for key in sorted(self.security_kco):
-                if (self.security_kco[key] != self.security_kco_ref[key]):
-                    valid = False
-                    if (key == "CONFIG_DEFAULT_SECURITY"):
-                        options = self.security_kco_ref[key].split(',')
-                        for option in options:
-                            if (option == self.security_kco[key]):
-                                valid = True
-                                break
-                    if ((key == "CONFIG_SECURITY_SELINUX") or
-                            (key == "CONFIG_SECURITY_SMACK") or
-                            (key == "CONFIG_SECURITY_APPARMOR") or
-                            (key == "CONFIG_SECURITY_TOMOYO")):
-                        if ((self.security_kco['CONFIG_SECURITY_SELINUX'] == 'y') or
-                                (self.security_kco['CONFIG_SECURITY_SMACK'] == 'y') or
-                                (self.security_kco['CONFIG_SECURITY_APPARMOR'] == 'y') or
-                                (self.security_kco['CONFIG_SECURITY_TOMOYO'] == 'y')):
-                            valid = True
-                    if not valid:
-                        freport.write("\nActual value:\n")
-                        freport.write(
-                            key + ' : ' + str(self.security_kco[key]) + '\n')
-                        self.append_recommendation(freport, key, self.security_kco_ref[key])
-            freport.write("\nIntegrity options that need improvement:\n")
-            for key in sorted(self.integrity_kco):
-                if (self.integrity_kco[key] != self.integrity_kco_ref[key]):
-                    valid = False
-                    if ((key == "CONFIG_IMA_DEFAULT_HASH_SHA1") or
-                            (key == "CONFIG_IMA_DEFAULT_HASH_SHA256") or
-                            (key == "CONFIG_IMA_DEFAULT_HASH_SHA512") or
-                            (key == "CONFIG_IMA_DEFAULT_HASH_WP512")):
-                        if ((self.integrity_kco['CONFIG_IMA_DEFAULT_HASH_SHA256'] == 'y') or
-                                (self.integrity_kco['CONFIG_IMA_DEFAULT_HASH_SHA512'] == 'y')):
-                            valid = True
-                    if not valid:
-                        freport.write("\nActual value:\n")
-                        freport.write(
-                            key + ' : ' + str(self.integrity_kco[key]) + '\n')
-                        self.append_recommendation(freport, key, self.integrity_kco_ref[key])
-
-    def write_xml_problems_report(self, ISA_kernel):
-        # write_problems_report_xml
-        num_tests = len(self.hardening_kco) + len(self.keys_kco) + \
-            len(self.security_kco) + len(self.integrity_kco)
-        root = etree.Element(
-            'testsuite', name='KCA_Plugin', tests=str(num_tests))
-        for key in sorted(self.hardening_kco):
-            tcase1 = etree.SubElement(
-                root, 'testcase', classname='Hardening options', name=key)
-            if (self.hardening_kco[key] != self.hardening_kco_ref[key]):
-                valid = False
-                if (key == "CONFIG_CMDLINE"):
-                    if (len(self.hardening_kco['CONFIG_CMDLINE']) > 0):
-                        valid = True
-                if (key == "CONFIG_DEBUG_STRICT_USER_COPY_CHECKS"):
-                    if (self.hardening_kco['CONFIG_ARCH_HAS_DEBUG_STRICT_USER_COPY_CHECKS'] == 'y'):
-                        valid = True
-                if (key == "CONFIG_RANDOMIZE_BASE_MAX_OFFSET"):
-                    options = self.hardening_kco_ref[key].split(',')
-                    for option in options:
-                        if (option == self.hardening_kco[key]):
-                            valid = True
-                            break
-                if not valid:
-                    msg1 = 'current=' + key + ' is ' + \
-                        str(self.hardening_kco[
-                            key]) + ', recommended=' + key + ' is ' + str(self.hardening_kco_ref[key])
-                    etree.SubElement(
-                        tcase1, 'failure', message=msg1, type='violation')
-        for key in sorted(self.keys_kco):
-            tcase2 = etree.SubElement(
-                root, 'testcase', classname='Key-related options', name=key)
-            if (self.keys_kco[key] != self.keys_kco_ref[key]):
-                msg2 = 'current=' + key + ' is ' + \
-                    str(self.keys_kco[key] + ', recommended=' +
-                        key + ' is ' + str(self.keys_kco_ref[key]))
-                etree.SubElement(
-                    tcase2, 'failure', message=msg2, type='violation')
-        for key in sorted(self.security_kco):
-            tcase3 = etree.SubElement(
-                root, 'testcase', classname='Security options', name=key)
-            if (self.security_kco[key] != self.security_kco_ref[key]):
-                valid = False
-                if (key == "CONFIG_DEFAULT_SECURITY"):
-                    options = self.security_kco_ref[key].split(',')
-                    for option in options:
-                        if (option == self.security_kco[key]):
-                            valid = True
-                            break
-                if ((key == "CONFIG_SECURITY_SELINUX") or
-                        (key == "CONFIG_SECURITY_SMACK") or
-                        (key == "CONFIG_SECURITY_APPARMOR") or
-                        (key == "CONFIG_SECURITY_TOMOYO")):
-                    if ((self.security_kco['CONFIG_SECURITY_SELINUX'] == 'y') or
-                            (self.security_kco['CONFIG_SECURITY_SMACK'] == 'y') or
-                            (self.security_kco['CONFIG_SECURITY_APPARMOR'] == 'y') or
-                            (self.security_kco['CONFIG_SECURITY_TOMOYO'] == 'y')):
-                        valid = True
-                if not valid:
-                    msg3 = 'current=' + key + ' is ' + \
-                        str(self.security_kco[key]) + ', recommended=' + \
-                        key + ' is ' + str(self.security_kco_ref[key])
-                    etree.SubElement(
-                        tcase3, 'failure', message=msg3, type='violation')
-        for key in sorted(self.integrity_kco):
-            tcase4 = etree.SubElement(
-                root, 'testcase', classname='Integrity options', name=key)
-            if (self.integrity_kco[key] != self.integrity_kco_ref[key]):
-                valid = False
-                if ((key == "CONFIG_IMA_DEFAULT_HASH_SHA1") or
-                        (key == "CONFIG_IMA_DEFAULT_HASH_SHA256") or
-                        (key == "CONFIG_IMA_DEFAULT_HASH_SHA512") or
-                        (key == "CONFIG_IMA_DEFAULT_HASH_WP512")):
-                    if ((self.integrity_kco['CONFIG_IMA_DEFAULT_HASH_SHA256'] == 'y') or
-                            (self.integrity_kco['CONFIG_IMA_DEFAULT_HASH_SHA512'] == 'y')):
-                        valid = True
-                if not valid:
-                    msg4 = 'current=' + key + ' is ' + \
-                        str(self.integrity_kco[
-                            key]) + ', recommended=' + key + ' is ' + str(self.integrity_kco_ref[key])
-                    etree.SubElement(
-                        tcase4, 'failure', message=msg4, type='violation')
-        tree = etree.ElementTree(root)
-        output = self.problems_report_name + "_" + ISA_kernel.img_name + '.xml'
-        try:
-            tree.write(output, encoding='UTF-8',
-                       pretty_print=True, xml_declaration=True)
-        except TypeError:
-            tree.write(output, encoding='UTF-8', xml_declaration=True)
+                    freport.write(key + ' : ' + str(value) + '\n')
+                    self.append_recommendation(freport, key, ref, comments)
+
+    def write_xml_problems_report(self, ISA_kernel, findings):
+        xml_report = isareport.ISA_junit(
+            self.problems_report_name + "_" + ISA_kernel.img_name + '.xml', 'KCA_Plugin')
+        for (title, key, value, ref, violation) in findings:
+            msg = None
+            if violation:
+                msg = 'current=' + key + ' is ' + str(value) + \
+                    ', recommended=' + key + ' is ' + str(ref)
+            xml_report.testcase(title, key, msg)
+        xml_report.close()
+
+    def write_matrix_report(self, results):
+        # One row per option and arch, one column per kernel. A cell holds
+        # the value of the option followed by " (violation)" if it fails,
+        # the cells of the kernels of other archs are empty. Kernels of
+        # the same image are told apart by their config file.
+        rows = collections.OrderedDict()
+        for column, (ISA_kernel, arch, findings) in enumerate(results):
+            for (title, key, value, ref, violation) in findings:
+                row = rows.get((title, key, arch))
+                if row is None:
+                    row = rows[(title, key, arch)] = [title, key, arch, ref] + [""] * len(results)
+                row[4 + column] = value + (" (violation)" if violation else "")
+        images = collections.Counter(ISA_kernel.img_name for ISA_kernel, arch, findings in results)
+        columns = [ISA_kernel.img_name if images[ISA_kernel.img_name] == 1
+                   else ISA_kernel.img_name + ":" + ISA_kernel.path_to_config
+                   for ISA_kernel, arch, findings in results]
+        group_order = dict((title, i) for i, (group, title) in enumerate(kco_groups))
+        with isareport.writer(self.matrix_report_name, 'w') as freport:
+            writer = csv.writer(freport, lineterminator='\n')
+            writer.writerow(["Group", "Option", "Arch", "Recommended"] + columns)
+            writer.writerow(["", "Violations", "", ""] +
+                            [str(sum(1 for finding in findings if finding[4]))
+                             for ISA_kernel, arch, findings in results])
+            for key in sorted(rows, key=lambda row: (group_order[row[0]], row[1], row[2])):
+                writer.writerow(rows[key])
+
+
+def parse_config(lines):
+    # Options of a kernel .config by name. Lines are either CONFIG_X=value
+    # or "# CONFIG_X is not set", the latter map to 'not set'.
+    options = {}
+    for line in lines:
+        if line.startswith('CONFIG_'):
+            key, sep, value = line.rstrip('\n').partition('=')
+            if sep:
+                options[key] = value
+        elif line.startswith('# CONFIG_') and line.rstrip().endswith(' is not set'):
+            options[line[2:].split(' ', 1)[0]] = 'not set'
+    return options
+
+
+class ISA_kca_rules:
+    """Checks of the options of one architecture, compiled from the
+    common and the arch config modules."""
+
+    def __init__(self, arch):
+        common = importlib.import_module('isafw.isaplugins.configs.kca.common')
+        arch_module = importlib.import_module('isafw.isaplugins.configs.kca.' + arch)
+        self.groups = []
+        for group, title in kco_groups:
+            defaults = merge_config(getattr(arch_module, group), getattr(common, group))
+            refs = merge_config(getattr(arch_module, group + "_ref"), getattr(common, group + "_ref"))
+            self.groups.append((title, [(key, defaults[key], refs[key]) for key in sorted(defaults)]))
+        self.comments = merge_config(arch_module.comments, common.comments)
+        refs = {}
+        for title, options in self.groups:
+            refs.update((key, ref) for key, default, ref in options)
+        self.allowed_values = {}
+        for key in common.allowed_values_kco + arch_module.allowed_values_kco:
+            self.allowed_values[key] = frozenset(refs[key].split(','))
+        self.non_empty = frozenset(common.non_empty_kco + arch_module.non_empty_kco)
+        self.any_of = {}
+        for members, alternatives in common.any_of_kco + arch_module.any_of_kco:
+            for key in members:
+                self.any_of[key] = tuple(alternatives)
+
+    def evaluate(self, options):
+        """Returns (group title, option, value, recommended value, violation)
+        for every option, by group and sorted by option within a group."""
+        values = {}
+        for title, group in self.groups:
+            for key, default, ref in group:
+                values[key] = options.get(key, default)
+        findings = []
+        for title, group in self.groups:
+            for key, default, ref in group:
+                value = values[key]
+                findings.append((title, key, value, ref, not self.accepted(key, value, ref, values)))
+        return findings
+
+    def accepted(self, key, value, ref, values):
+        if value == ref:
+            return True
+        if key in self.non_empty and len(value) > 0:
+            return True
+        if value in self.allowed_values.get(key, ()):
+            return True
+        for alternative in self.any_of.get(key, ()):
+            if values.get(alternative) == 'y':
+                return True
+        return False
+
+
+def evaluate_kernel(job):
+    # runs in the worker processes, returns (findings, error)
+    path_to_config, arch = job
+    try:
+        with open(path_to_config, 'r') as fkernel_conf:
+            return kca_rules(arch).evaluate(parse_config(fkernel_conf)), None
+    except (IOError, OSError):
+        return None, str(sys.exc_info()[1])
+
+
+def kca_rules(arch):
+    # the rules are compiled once per architecture and process
+    rules = compiled_rules.get(arch)
+    if rules is None:
+        rules = compiled_rules[arch] = ISA_kca_rules(arch)
+    return rules
 
 
 def merge_config(arch_kco, common_kco):
@@ -320,4 +300,9 @@ def getPluginName():
 def process_kernel(ISA_kernel):
     global KCAnalyzer
     return KCAnalyzer.process_kernel(ISA_kernel)
+
+
+def process_kernels(ISA_kernels):
+    global KCAnalyzer
+    return KCAnalyzer.process_kernels(ISA_kernels)
 # ==================================================== #
@@ -29,6 +29,7 @@
 
 import subprocess
 import os, sys
+from isafw import isareport
 
 LicenseChecker = None
 
@@ -37,6 +38,10 @@ fapproved_non_osi = "/configs/la/approved-non-osi"
 fexceptions = "/configs/la/exceptions"
 funwanted = "/configs/la/violations"
 
+# parsed license files and the stat of the file they were read from,
+# shared by all plugin instances of the process
+license_tables = {}
+
 
 class ISA_LicenseChecker():
     initialized = False
@@ -48,11 +53,14 @@ class ISA_LicenseChecker():
         self.report_name = ISA_config.reportdir + "/la_problems_report_" + \
             ISA_config.machine + "_" + ISA_config.timestamp
         self.image_pkg_list = ISA_config.reportdir + "/pkglist"
+        # (binary package, image, origin package) in the order of the list,
+        # indexed by both the binary and the origin package name
         self.image_pkgs = []
-        self.la_plugin_image_whitelist = ISA_config.la_plugin_image_whitelist
-        self.la_plugin_image_blacklist = ISA_config.la_plugin_image_blacklist
+        self.image_pkgs_by_name = {}
+        self.la_plugin_image_whitelist = image_set(ISA_config.la_plugin_image_whitelist)
+        self.la_plugin_image_blacklist = image_set(ISA_config.la_plugin_image_blacklist)
         self.initialized = True
-        with open(self.logfile, 'a') as flog:
+        with isareport.writer(self.logfile, 'a') as flog:
             flog.write("\nPlugin ISA_LA initialized!\n")
         # check that rpm is installed (supporting only rpm packages for now)
         DEVNULL = open(os.devnull, 'wb')
@@ -61,7 +69,7 @@ class ISA_LicenseChecker():
         if rc == 0:
             self.rpm_present = True
         else:
-            with open(self.logfile, 'a') as flog:
+            with isareport.writer(self.logfile, 'a') as flog:
                 flog.write("rpm tool is missing! Licence info is expected from build system\n")
 
     def process_package(self, ISA_pkg):
@@ -71,74 +79,72 @@ class ISA_LicenseChecker():
                     # need to determine licenses first
                     # for this we need rpm tool to be present
                     if (not self.rpm_present):
-                        with open(self.logfile, 'a') as flog:
+                        with isareport.writer(self.logfile, 'a') as flog:
                             flog.write("rpm tool is missing and licence info is not provided. Cannot proceed.\n")
                             return;     
                     if (not ISA_pkg.source_files):
                         if (not ISA_pkg.path_to_sources):
                             self.initialized = False
-                            with open(self.logfile, 'a') as flog:
+                            with isareport.writer(self.logfile, 'a') as flog:
                                 flog.write(
                                     "No path to sources or source file list is provided!")
                                 flog.write(
                                     "\nNot able to determine licenses for package: " + ISA_pkg.name)
                             return
                         # need to build list of source files
-                        ISA_pkg.source_files = self.find_files(
-                            ISA_pkg.path_to_sources)
-                    for i in ISA_pkg.source_files:
-                        if (i.endswith(".spec")):# supporting rpm only for now
-                            args = ("rpm", "-q", "--queryformat",
-                                    "%{LICENSE} ", "--specfile", i)
-                            try:
-                                popen = subprocess.Popen(
-                                    args, stdout=subprocess.PIPE)
-                                popen.wait()
-                                ISA_pkg.licenses = popen.stdout.read().split()
-                            except:
-                                self.initialized = False
-                                with open(self.logfile, 'a') as flog:
-                                    flog.write(
-                                        "Error in executing rpm query: " + str(sys.exc_info()))
-                                    flog.write(
-                                        "\nNot able to process package: " + ISA_pkg.name)
+                        ISA_pkg.source_files = list(self.find_files(
+                            ISA_pkg.path_to_sources))
+                    # supporting rpm only for now
+                    spec_files = [i for i in ISA_pkg.source_files if i.endswith(".spec")]
+                    for spec_file in spec_files:
+                        licenses, error = rpm_query_licenses(spec_file)
+                        if error:
+                            self.initialized = False
+                            with isareport.writer(self.logfile, 'a') as flog:
+                                flog.write(
+                                    "Error in executing rpm query: " + error)
+                                flog.write(
+                                    "\nNot able to process package: " + ISA_pkg.name)
                                 return
+                        ISA_pkg.licenses = licenses
+                self.load_license_tables()
                 for l in ISA_pkg.licenses:
-                    if (not self.check_license(l, flicenses) and
-                            not self.check_license(l, fapproved_non_osi) and
-                            not self.check_exceptions(ISA_pkg.name, l, fexceptions)):
+                    if (not self.check_license(l, self.licenses) and
+                            not self.check_license(l, self.approved_non_osi) and
+                            not self.check_exceptions(ISA_pkg.name, l, self.exceptions)):
                         # log the package as not following correct license
-                        with open(self.report_name, 'a') as freport:
+                        with isareport.writer(self.report_name, 'a') as freport:
                             freport.write(l + "\n")
-                    if (self.check_license(l, funwanted)):
+                    if (self.check_license(l, self.violations)):
                         # log the package as having license that should not be
                         # used
-                        with open(self.report_name + "_unwanted", 'a') as freport:
+                        with isareport.writer(self.report_name + "_unwanted", 'a') as freport:
                             freport.write(l + "\n")
             else:
                 self.initialized = False
-                with open(self.logfile, 'a') as flog:
+                with isareport.writer(self.logfile, 'a') as flog:
                     flog.write(
                         "Mandatory argument package name is not provided!\n")
                     flog.write("Not performing the call.\n")
         else:
-            with open(self.logfile, 'a') as flog:
+            with isareport.writer(self.logfile, 'a') as flog:
                 flog.write(
                     "Plugin hasn't initialized! Not performing the call.")
 
     def process_report(self):
         if (self.initialized):
-            with open(self.logfile, 'a') as flog:
+            with isareport.writer(self.logfile, 'a') as flog:
                 flog.write("Creating report with violating licenses.\n")
             self.process_pkg_list()
             self.write_report_unwanted()
-            with open(self.logfile, 'a') as flog:
+            with isareport.writer(self.logfile, 'a') as flog:
                 flog.write("Creating report in XML format.\n")
             self.write_report_xml()
 
     def process_pkg_list(self):
         if os.path.isfile (self.image_pkg_list):
             img_name = ""
+            image_pkg_keys = set((pkg_info[0], pkg_info[1]) for pkg_info in self.image_pkgs)
             with open(self.image_pkg_list, 'r') as finput:
                 for line in finput:
                     line = line.strip()
@@ -146,25 +152,24 @@ class ISA_LicenseChecker():
                         continue
                     if line.startswith("Packages "):
                         img_name = line.split()[3]
-                        with open(self.logfile, 'a') as flog:
+                        with isareport.writer(self.logfile, 'a') as flog:
                             flog.write("img_name: " + img_name + "\n")
                         continue
                     package_info = line.split()
                     pkg_name = package_info[0]
                     orig_pkg_name = package_info[2]
-                    if (not self.image_pkgs) or ((pkg_name + " from " + img_name) not in self.image_pkgs):
-                        self.image_pkgs.append(pkg_name + " from " + img_name + " " + orig_pkg_name)
+                    if (pkg_name, img_name) in image_pkg_keys:
+                        continue
+                    image_pkg_keys.add((pkg_name, img_name))
+                    pkg_info = (pkg_name, img_name, orig_pkg_name)
+                    self.image_pkgs.append(pkg_info)
+                    self.image_pkgs_by_name.setdefault(pkg_name, []).append(pkg_info)
+                    if orig_pkg_name != pkg_name:
+                        self.image_pkgs_by_name.setdefault(orig_pkg_name, []).append(pkg_info)
 
     def write_report_xml(self):
-        try:
-            from lxml import etree
-        except ImportError:
-            try:
-                import xml.etree.cElementTree as etree
-            except ImportError:
-                import xml.etree.ElementTree as etree
-        num_tests = 0
-        root = etree.Element('testsuite', name='LA_Plugin', tests='2')
+        xml_report = isareport.ISA_junit(self.report_name + '.xml', 'LA_Plugin')
+        isareport.flush(self.report_name)
         if os.path.isfile(self.report_name):
             with open(self.report_name, 'r') as f:
                 class_name = "Non-approved-licenses"
@@ -175,31 +180,19 @@ class ISA_LicenseChecker():
                     if line.startswith("Packages that "):
                         class_name = "Violating-licenses"
                         continue
-                    num_tests += 1
-                    tcase1 = etree.SubElement(
-                        root, 'testcase', classname=class_name, name=line.split(':', 1)[0])
-                    etree.SubElement(
-                        tcase1, 'failure', message=line, type='violation')
+                    xml_report.testcase(class_name, line.split(':', 1)[0], line)
         else:
-            tcase1 = etree.SubElement(
-                root, 'testcase', classname='ISA_LAChecker', name='none')
-            num_tests = 1
-        root.set('tests', str(num_tests))
-        tree = etree.ElementTree(root)
-        output = self.report_name + '.xml'
-        try:
-            tree.write(output, encoding='UTF-8',
-                       pretty_print=True, xml_declaration=True)
-        except TypeError:
-            tree.write(output, encoding='UTF-8', xml_declaration=True)
+            xml_report.testcase('ISA_LAChecker', 'none')
+        xml_report.close()
 
     def write_report_unwanted(self):
         if os.path.isfile(self.report_name + "_unwanted"):
-            with open(self.logfile, 'a') as flog:
+            with isareport.writer(self.logfile, 'a') as flog:
                 flog.write("image_pkgs: " + str(self.image_pkgs) + "\n")
-                flog.write("self.la_plugin_image_whitelist: " + str(self.la_plugin_image_whitelist) + "\n")
-                flog.write("self.la_plugin_image_blacklist: " + str(self.la_plugin_image_blacklist) + "\n")
-            with open(self.report_name, 'a') as fout:
+                flog.write("self.la_plugin_image_whitelist: " + str(sorted(self.la_plugin_image_whitelist)) + "\n")
+                flog.write("self.la_plugin_image_blacklist: " + str(sorted(self.la_plugin_image_blacklist)) + "\n")
+            isareport.flush(self.report_name + "_unwanted")
+            with isareport.writer(self.report_name, 'a') as fout:
                 with open(self.report_name + "_unwanted", 'r') as f:
                     fout.write(
                         "\n\nPackages that violate mandatory license requirements:\n")
@@ -209,46 +202,87 @@ class ISA_LicenseChecker():
                         if (not self.image_pkgs):
                             fout.write(line + " from image name not available \n")
                             continue
-                        for pkg_info in self.image_pkgs:
-                            image_pkg_name = pkg_info.split()[0]
-                            image_name = pkg_info.split()[2]
-                            image_orig_pkg_name = pkg_info.split()[3]
-                            if ((image_pkg_name == pkg_name) or (image_orig_pkg_name == pkg_name)):
-                                if self.la_plugin_image_whitelist and (image_name not in self.la_plugin_image_whitelist):
-                                    continue
-                                if self.la_plugin_image_blacklist and (image_name in self.la_plugin_image_blacklist):
-                                    continue
-                                fout.write(line + " from image " + image_name)
-                                if (image_pkg_name != image_orig_pkg_name):
-                                    fout.write(" binary_pkg_name " + image_pkg_name + "\n")
-                                    continue
-                                fout.write("\n")
+                        for (image_pkg_name, image_name, image_orig_pkg_name) in \
+                                self.image_pkgs_by_name.get(pkg_name, ()):
+                            if self.la_plugin_image_whitelist and (image_name not in self.la_plugin_image_whitelist):
+                                continue
+                            if self.la_plugin_image_blacklist and (image_name in self.la_plugin_image_blacklist):
+                                continue
+                            fout.write(line + " from image " + image_name)
+                            if (image_pkg_name != image_orig_pkg_name):
+                                fout.write(" binary_pkg_name " + image_pkg_name + "\n")
+                                continue
+                            fout.write("\n")
             os.remove(self.report_name + "_unwanted")
 
     def find_files(self, init_path):
-        list_of_files = []
         for (dirpath, dirnames, filenames) in os.walk(init_path):
             for f in filenames:
-                list_of_files.append(str(dirpath + "/" + f)[:])
-        return list_of_files
-
-    def check_license(self, license, file_path):
-        with open(os.path.dirname(__file__) + file_path, 'r') as f:
-            for line in f:
-                s = line.rstrip()
-                curr_license = license.split(':',1)[1]
-                if s == curr_license:
-                    return True
-        return False
-
-    def check_exceptions(self, pkg_name, license, file_path):
-        with open(os.path.dirname(__file__) + file_path, 'r') as f:
-            for line in f:
-                s = line.rstrip()
-                curr_license = license.split(':',1)[1]
-                if s == pkg_name + " " + curr_license:
-                    return True
-        return False
+                yield dirpath + "/" + f
+
+    def load_license_tables(self):
+        self.licenses = load_license_table(flicenses, license_set)
+        self.approved_non_osi = load_license_table(fapproved_non_osi, license_set)
+        self.exceptions = load_license_table(fexceptions, exceptions_dict)
+        self.violations = load_license_table(funwanted, license_set)
+
+    def check_license(self, license, licenses):
+        if not licenses:
+            return False
+        curr_license = license.split(':',1)[1]
+        return curr_license in licenses
+
+    def check_exceptions(self, pkg_name, license, exceptions):
+        if not exceptions:
+            return False
+        curr_license = license.split(':',1)[1]
+        return curr_license in exceptions.get(pkg_name, ())
+
+
+def rpm_query_licenses(spec_file):
+    # runs in the worker processes, returns (licenses, error)
+    args = ("rpm", "-q", "--queryformat",
+            "%{LICENSE} ", "--specfile", spec_file)
+    try:
+        popen = subprocess.Popen(args, stdout=subprocess.PIPE)
+        output = popen.communicate()[0]
+    except:
+        return None, str(sys.exc_info())
+    return output.decode('utf-8').split(), None
+
+
+def image_set(images):
+    # image lists come as a list or as a comma or space separated string
+    if isinstance(images, str):
+        images = images.replace(",", " ").split()
+    return frozenset(image for image in images if image)
+
+
+def load_license_table(file_path, parse):
+    # the files are only read again when they change on disk
+    path = os.path.dirname(__file__) + file_path
+    st = os.stat(path)
+    stamp = (st.st_mtime, st.st_size, st.st_ino)
+    table = license_tables.get(file_path)
+    if table is None or table[0] != stamp:
+        with open(path, 'r') as f:
+            table = license_tables[file_path] = (stamp, parse(f))
+    return table[1]
+
+
+def license_set(f):
+    return frozenset(line.rstrip() for line in f)
+
+
+def exceptions_dict(f):
+    # lines are "<package name> <license>"
+    exceptions = {}
+    for line in f:
+        pkg_name, sep, license = line.rstrip().partition(" ")
+        if sep:
+            exceptions.setdefault(pkg_name, set()).add(license)
+    return dict((pkg_name, frozenset(licenses))
+                for pkg_name, licenses in exceptions.items())
 
 # ======== supported callbacks from ISA ============= #
 
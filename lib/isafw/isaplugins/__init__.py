@@ -26,17 +26,55 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+"""ISA plugins.
+
+Plugins are listed in the manifest below with the name they report from
+getPluginName() and the callbacks they define, so that isafw can select
+them without importing anything. A plugin module is only imported by
+load(), when one of its callbacks is actually called. Modules dropped into
+this directory without a manifest entry are still found, but have to be
+imported to learn their name and callbacks.
+"""
+
 import glob
+import importlib
 import keyword
 import os
 import sys
 
 basedir = os.path.dirname(__file__)
 
+# plugin module: (plugin name, callbacks other than init and getPluginName)
+manifest = {
+    "ISA_cfa_plugin": ("ISA_CFChecker", ("process_filesystem",)),
+    "ISA_cve_plugin": ("ISA_CVEChecker", ("process_package", "process_report")),
+    "ISA_fsa_plugin": ("ISA_FSChecker", ("process_filesystem",)),
+    "ISA_kca_plugin": ("ISA_KernelChecker", ("process_kernel", "process_kernels")),
+    "ISA_la_plugin": ("ISA_LicenseChecker", ("process_package", "process_report")),
+}
+
 __all__ = []
 for name in glob.glob(os.path.join(basedir, '*.py')):
     module = os.path.splitext(os.path.split(name)[-1])[0]
     if not module.startswith('_') and not keyword.iskeyword(module):
-        __import__(__name__ + '.' + module)
         __all__.append(module)
 __all__.sort()
+
+
+def load(module):
+    """Imports and returns the plugin module."""
+    return importlib.import_module(__name__ + '.' + module)
+
+
+def plugin_name(module):
+    """Returns the plugin name of module, importing it only if unlisted."""
+    if module in manifest:
+        return manifest[module][0]
+    return load(module).getPluginName()
+
+
+def has_callback(module, callback):
+    """Tells whether module defines callback, importing it only if unlisted."""
+    if module in manifest:
+        return callback in manifest[module][1]
+    return callable(getattr(load(module), callback, None))
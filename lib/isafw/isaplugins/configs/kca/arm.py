@@ -19,6 +19,12 @@ security_kco_ref = {'CONFIG_LSM_MMAP_MIN_ADDR': '32768',}
 integrity_kco = {}
 integrity_kco_ref = {}
 ############################################################################################
+# Validation Rules
+############################################################################################
+allowed_values_kco = []
+non_empty_kco = []
+any_of_kco = []
+############################################################################################
 # Comments
 ############################################################################################
 comments = {'CONFIG_DEFAULT_MMAP_MIN_ADDR': 'Defines the portion of low virtual memory that should be protected from userspace allocation. Keeping a user from writing to low pages can help reduce the impact of kernel NULL pointer bugs.'}
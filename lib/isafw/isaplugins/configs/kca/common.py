@@ -183,6 +183,27 @@ integrity_kco_ref = {'CONFIG_INTEGRITY': 'y',
                      'CONFIG_IMA_DEFAULT_HASH_WP512': 'not set'
                      }
 ############################################################################################
+# Validation Rules
+# An option that differs from its recommended value is still accepted if:
+############################################################################################
+# its recommended value is a comma separated list and the value is one of them
+allowed_values_kco = ['CONFIG_DEFAULT_SECURITY']
+# it has any value at all
+non_empty_kco = ['CONFIG_CMDLINE']
+# any of the options listed with it is set to y
+any_of_kco = [
+    # a single LSM is enough
+    (['CONFIG_SECURITY_SELINUX', 'CONFIG_SECURITY_SMACK', 'CONFIG_SECURITY_APPARMOR', 'CONFIG_SECURITY_TOMOYO'],
+     ['CONFIG_SECURITY_SELINUX', 'CONFIG_SECURITY_SMACK', 'CONFIG_SECURITY_APPARMOR', 'CONFIG_SECURITY_TOMOYO']),
+    # a single strong default IMA hash is enough
+    (['CONFIG_IMA_DEFAULT_HASH_SHA1', 'CONFIG_IMA_DEFAULT_HASH_SHA256',
+      'CONFIG_IMA_DEFAULT_HASH_SHA512', 'CONFIG_IMA_DEFAULT_HASH_WP512'],
+     ['CONFIG_IMA_DEFAULT_HASH_SHA256', 'CONFIG_IMA_DEFAULT_HASH_SHA512']),
+    # the architecture always checks user copies
+    (['CONFIG_DEBUG_STRICT_USER_COPY_CHECKS'],
+     ['CONFIG_ARCH_HAS_DEBUG_STRICT_USER_COPY_CHECKS']),
+]
+############################################################################################
 # Comments
 ############################################################################################
 comments = {  # Kernel Hardening Configurations
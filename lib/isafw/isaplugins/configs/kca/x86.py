@@ -29,6 +29,12 @@ security_kco_ref = {'CONFIG_LSM_MMAP_MIN_ADDR': '65536',  # x86 specific
 integrity_kco = {}
 integrity_kco_ref = {}
 ############################################################################################
+# Validation Rules
+############################################################################################
+allowed_values_kco = ['CONFIG_RANDOMIZE_BASE_MAX_OFFSET']  # x86 specific
+non_empty_kco = []
+any_of_kco = []
+############################################################################################
 # Comments
 ############################################################################################
 comments = {'CONFIG_DEFAULT_MMAP_MIN_ADDR': 'Defines the portion of low virtual memory that should be protected from userspace allocation. Keeping a user from writing to low pages can help reduce the impact of kernel NULL pointer bugs.',
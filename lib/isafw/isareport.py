@@ -0,0 +1,215 @@
+#
+# isareport.py - Buffered report and log writers, part of ISA FW
+#
+# Copyright (c) 2015 - 2016, Intel Corporation
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Intel Corporation nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""Shared writers for the reports and logs produced by the plugins.
+
+Plugins append to their outputs one record at a time. Instead of opening
+the file for every record, writer() hands out one buffered handle per path
+that is kept open until close(). ISA calls it at the end of
+process_report(), and it runs at exit. Buffered data is written out after
+every plugin call and by flush(). Data is only ever written in whole
+write() calls, so several bitbake tasks appending to the same log do not
+split each other's records.
+
+ISA_junit writes the JUnit XML reports one testcase at a time, without
+building an element tree first. The output is identical to what lxml
+produces with pretty_print for the same elements.
+
+json_record() appends machine-readable records, one JSON object per line.
+"""
+
+import atexit
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+# buffered characters that trigger a write to the file
+buffer_size = 1 << 16
+# bytes of a JUnit report section kept in memory before spilling to disk
+spool_size = 1 << 20
+
+_writers = {}
+_lock = threading.Lock()
+
+
+class ISA_writer:
+
+    def __init__(self, path, mode):
+        flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND
+        if mode == 'w':
+            flags |= os.O_TRUNC
+        self.path = path
+        self.fd = os.open(path, flags, 0o666)
+        self.pid = os.getpid()
+        self.chunks = []
+        self.size = 0
+        self.lock = threading.Lock()
+
+    # the handle is shared, leaving a with block does not close it
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+    def write(self, data):
+        with self.lock:
+            self.chunks.append(data)
+            self.size += len(data)
+            if self.size >= buffer_size:
+                self._flush()
+
+    def _flush(self):
+        # children forked by a worker pool inherit the buffers, only the
+        # process that wrote the data writes it out
+        if self.chunks and self.pid == os.getpid():
+            data = "".join(self.chunks).encode('utf-8')
+            while data:
+                data = data[os.write(self.fd, data):]
+        self.chunks = []
+        self.size = 0
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            os.close(self.fd)
+
+
+def writer(path, mode='a'):
+    """Returns the shared writer for path.
+
+    mode 'w' truncates the file and drops whatever was buffered for it,
+    mode 'a' keeps appending to the file.
+    """
+    key = os.path.abspath(path)
+    with _lock:
+        w = _writers.get(key)
+        if w and mode == 'w':
+            w.chunks = []
+            w.close()
+            w = None
+        if not w or w.pid != os.getpid():
+            w = _writers[key] = ISA_writer(path, mode)
+        return w
+
+
+def flush(path=None):
+    """Writes out the buffered data of path, or of all writers."""
+    with _lock:
+        if path is None:
+            writers = list(_writers.values())
+        else:
+            writers = [w for w in [_writers.get(os.path.abspath(path))] if w]
+    for w in writers:
+        w.flush()
+
+
+def close(path=None):
+    """Writes out the buffered data and closes the writer of path, or all."""
+    with _lock:
+        if path is None:
+            writers = list(_writers.values())
+            _writers.clear()
+        else:
+            writers = [w for w in [_writers.pop(os.path.abspath(path), None)] if w]
+    for w in writers:
+        w.close()
+
+
+def json_record(path, record):
+    """Appends record to path as one line of JSON."""
+    with writer(path, 'a') as f:
+        f.write(json.dumps(record, sort_keys=True) + '\n')
+
+
+def xml_escape(value):
+    """Escapes value for use in a double quoted XML attribute."""
+    return value.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;') \
+        .replace('"', '&quot;').replace('\n', '&#10;').replace('\r', '&#13;') \
+        .replace('\t', '&#9;')
+
+
+class ISA_junit:
+    """JUnit XML report written one testcase at a time.
+
+    The number of tests goes into the root element, so testcases are
+    spooled (in memory, then in a temporary file) until close(). Testcases
+    can be grouped into sections that are written in the order given,
+    whatever order they were added in.
+    """
+
+    def __init__(self, path, name, sections=(None,)):
+        self.path = path
+        self.name = name
+        self.tests = 0
+        self.order = list(sections)
+        self.spools = {}
+
+    def testcase(self, classname, name, message=None, section=None, tag='testcase'):
+        self.tests += 1
+        if message is None:
+            element = '  <%s classname="%s" name="%s"/>\n' % (
+                tag, xml_escape(classname), xml_escape(name))
+        else:
+            element = '  <%s classname="%s" name="%s">\n' \
+                '    <failure message="%s" type="violation"/>\n' \
+                '  </%s>\n' % (tag, xml_escape(classname), xml_escape(name),
+                                xml_escape(message), tag)
+        spool = self.spools.get(section)
+        if spool is None:
+            if section not in self.order:
+                raise ValueError("Unknown report section " + str(section))
+            spool = self.spools[section] = tempfile.SpooledTemporaryFile(
+                max_size=spool_size, mode='w+b')
+        spool.write(element.encode('utf-8'))
+
+    def close(self):
+        with open(self.path, 'wb') as f:
+            f.write(b"<?xml version='1.0' encoding='UTF-8'?>\n")
+            root = '<testsuite name="%s" tests="%d"' % (xml_escape(self.name), self.tests)
+            if not self.tests:
+                f.write((root + '/>\n').encode('utf-8'))
+                return
+            f.write((root + '>\n').encode('utf-8'))
+            for section in self.order:
+                spool = self.spools.pop(section, None)
+                if spool is not None:
+                    spool.seek(0)
+                    shutil.copyfileobj(spool, f)
+                    spool.close()
+            f.write(b'</testsuite>\n')
+
+
+atexit.register(close)
@@ -0,0 +1,83 @@
+#
+# test_cve_patches.py - Tests of the CVE ids taken from patch names, part of ISA FW
+#
+# Copyright (c) 2015 - 2016, Intel Corporation
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Intel Corporation nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from isafw.isaplugins import ISA_cve_plugin as cve
+
+# patch name, the CVE ids it names
+corpus = [
+    ("None", []),
+    ("0001-Fix-build-with-gcc-6.patch", []),
+    ("CVE-2016-1234.patch", ["CVE-2016-1234"]),
+    ("cve-2016-1234.patch", ["CVE-2016-1234"]),
+    ("0001-CVE-2015-7547.patch", ["CVE-2015-7547"]),
+    ("0002-libxml2-CVE-2016-4658.patch", ["CVE-2016-4658"]),
+    ("CVE-2014-0160-heartbleed.patch", ["CVE-2014-0160"]),
+    ("CVE-2016-10033.patch", ["CVE-2016-10033"]),
+    ("CVE_2016_1234.patch", ["CVE-2016-1234"]),
+    ("cve_2016_5636.patch", ["CVE-2016-5636"]),
+    ("Cve-2016-0718.patch", ["CVE-2016-0718"]),
+    ("CVE-2016-6302_6303.patch", ["CVE-2016-6302"]),
+    ("CVE-2016-2177-CVE-2016-2178.patch", ["CVE-2016-2177", "CVE-2016-2178"]),
+    ("fix-CVE-2015-8380-and-CVE-2015-8381.patch", ["CVE-2015-8380", "CVE-2015-8381"]),
+    ("bash43-047-CVE-2016-0634.patch", ["CVE-2016-0634"]),
+    ("CVE-2016.patch", []),
+    ("cve-check-tool-config.patch", []),
+    ("0001-configure-avoid-CVE-.patch", []),
+]
+
+
+class TestPatchCves(unittest.TestCase):
+
+    def setUp(self):
+        cve.patch_cve_ids.clear()
+
+    def test_corpus(self):
+        for name, expected in corpus:
+            self.assertEqual(cve.patch_cves([name]), expected, name)
+
+    def test_corpus_together(self):
+        # one pass over all the names gives the ids in order, once each
+        expected = []
+        for name, cve_ids in corpus:
+            expected += [cve_id for cve_id in cve_ids if cve_id not in expected]
+        self.assertEqual(cve.patch_cves([name for name, cve_ids in corpus]), expected)
+
+    def test_paths(self):
+        # only the file name counts, not the directories
+        self.assertEqual(cve.patch_cves(["files/CVE-2016-1234.patch"]), ["CVE-2016-1234"])
+        self.assertEqual(cve.patch_cves(["CVE-2016-1234/fix.patch"]), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+#
+# test_isanvd.py - Tests of the offline NVD index, part of ISA FW
+#
+# Copyright (c) 2015 - 2016, Intel Corporation
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Intel Corporation nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from isafw import isanvd
+
+
+def feed_item(cve, uri, **ranges):
+    match = {"vulnerable": True, "cpe23Uri": uri}
+    match.update(ranges)
+    return {
+        "cve": {"CVE_data_meta": {"ID": cve}},
+        "configurations": {"nodes": [{"operator": "OR", "cpe_match": [match]}]},
+        "lastModifiedDate": "2016-01-01T00:00Z",
+    }
+
+
+class TestVersions(unittest.TestCase):
+
+    def test_order(self):
+        ordered = ["1.0alpha", "1.0beta2", "1.0pre", "1.0rc1", "1.0rc2", "1.0",
+                   "1.0k", "1.0.1", "1.2", "1.10"]
+        keys = [isanvd.version_key(v) for v in ordered]
+        self.assertEqual(keys, sorted(keys))
+        self.assertEqual(len(set(keys)), len(keys))
+
+    def test_separators(self):
+        self.assertEqual(isanvd.version_key("1.0-rc1"), isanvd.version_key("1.0rc1"))
+        self.assertEqual(isanvd.version_key("1.0RC1"), isanvd.version_key("1.0rc1"))
+
+    def test_prerelease_in_range(self):
+        self.assertTrue(isanvd.version_matches("1.0rc1", ("*", None, None, None, "1.0")))
+        self.assertTrue(isanvd.version_matches("1.0rc1", ("*", None, None, "1.0", None)))
+        self.assertFalse(isanvd.version_matches("1.0rc1", ("*", "1.0", None, None, None)))
+        self.assertFalse(isanvd.version_matches("1.0", ("*", None, None, None, "1.0")))
+        self.assertTrue(isanvd.version_matches("1.0", ("*", None, "1.0rc2", None, None)))
+
+
+class TestIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_vendor_case(self):
+        feed = {"CVE_Items": [
+            feed_item("CVE-2016-0001", "cpe:2.3:a:GNU:Bash:4.3:*:*:*:*:*:*:*"),
+        ]}
+        items = list(isanvd.feed_items(feed))
+        self.assertEqual(items[0][4][0][:3], ("gnu", "bash", "4.3"))
+
+        path = os.path.join(self.dir, "nvdcve-1.1-2016.json")
+        with open(path, 'w') as f:
+            json.dump(feed, f)
+        nvd = isanvd.ISA_nvd(os.path.join(self.dir, "db"))
+        try:
+            nvd.update([path])
+            self.assertEqual(nvd.vendors("bash"), ["gnu"])
+            self.assertEqual(nvd.match("bash", "4.3", vendors=["gnu"]), (["CVE-2016-0001"], []))
+            self.assertEqual(nvd.match("bash", "4.3", vendors=["GNU"]), (["CVE-2016-0001"], []))
+        finally:
+            nvd.close()
+
+
+if __name__ == '__main__':
+    unittest.main()